@@ -0,0 +1,288 @@
+"""
+Offline benchmarks for the SQLite wrapper.
+
+Runs without an Anvil app or Uplink key: anvil.server.call is replaced with an
+in-process stand-in that dispatches to the real uplink_server callables, backed
+by a temporary SQLite file. Synthetic tables with the keys from get_id_field are
+migrated with migration_script, then search, get, add_row, update_row and delete
+are timed through wrapper.app_tables. text_search times full_text_match on the
+'name' column, which is FTS5-indexed for the tables in FULL_TEXT_COLUMNS.
+
+Usage:
+    python benchmark.py                              # 1k, 100k and 1M rows
+    python benchmark.py --sizes 1000,100000 --repeats 500
+    python benchmark.py --tables candidates --json results.json
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+import anvil.server
+from anvil.tables import query as q
+
+# Row counts of the synthetic tables, one benchmark run per size
+BENCHMARK_SIZES = [1000, 100000, 1000000]
+
+# Tables generated and benchmarked by default: one with a single key, one with a composite key
+BENCHMARK_TABLES = ['candidates', 'candidateprojectmapping']
+
+# Timed calls per operation and table
+OPERATION_REPEATS = 200
+
+# Rows read from each search (the first page)
+SEARCH_ROWS = 100
+
+# Round-trip arguments and results through JSON, as the Uplink serializes them
+SERIALIZE_CALLS = True
+
+# Values of the 'status' column, used as the search condition
+STATUSES = ['new', 'screening', 'interview', 'offer', 'hired']
+
+# Callables registered by the Uplink modules, by name
+_callables = {}
+
+
+def _register_callable(function=None, *args, **kwargs):
+    """Stand-in for anvil.server.callable that records functions for the local Uplink."""
+    if callable(function):
+        _callables[function.__name__] = function
+        return function
+
+    def register(fn):
+        _callables[function if isinstance(function, str) else fn.__name__] = fn
+        return fn
+    return register
+
+
+def _local_call(function_name, *args, **kwargs):
+    """Stand-in for anvil.server.call that runs the registered callable in this process."""
+    if SERIALIZE_CALLS:
+        args, kwargs = json.loads(json.dumps([args, kwargs]))
+        return json.loads(json.dumps(_callables[function_name](*args, **kwargs)))
+    return _callables[function_name](*args, **kwargs)
+
+
+def install_local_uplink(work_dir):
+    """
+    Patches anvil.server and imports uplink_server, migration_script and wrapper
+    against the stand-in. Returns the three modules.
+    """
+    anvil.server.callable = _register_callable
+    anvil.server.call = _local_call
+
+    # uplink_server creates local.db and media_files in the working directory on import
+    os.chdir(work_dir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import uplink_server
+    import migration_script
+    import wrapper
+
+    # The Anvil tables are not reachable offline, so replication is disabled
+    wrapper.original_app_tables = types.SimpleNamespace()
+    wrapper.REPLICATE_TO_ANVIL = False
+    return uplink_server, migration_script, wrapper
+
+
+def use_database(uplink_server, migration_script, db_path):
+    """Points the Uplink server and the migration at a fresh database file."""
+    while not uplink_server._connection_pool.empty():
+        uplink_server._connection_pool.get_nowait().close()
+    uplink_server.DB_PATH = db_path
+    migration_script.LOCAL_DB_PATH = db_path
+    uplink_server.ensure_metadata_tables()
+    uplink_server.refresh_schema_registry()
+
+
+def key_fields(uplink_server, table_name):
+    """Returns the key field(s) of a table as a list."""
+    id_fields = uplink_server.get_id_field(table_name)
+    return [id_fields] if isinstance(id_fields, str) else list(id_fields)
+
+
+def synthetic_row(fields, index):
+    """
+    Returns row number `index` of a synthetic table. Single keys are unique per
+    row; composite keys combine index // 10 with index % 10, which is unique too.
+    """
+    row = {}
+    for position, field in enumerate(fields):
+        if field == 'email':
+            row[field] = f"user{index}@example.com"
+        elif len(fields) == 1:
+            row[field] = f"{field}-{index:07d}"
+        elif position == 0:
+            row[field] = f"{field}-{index // 10:07d}"
+        else:
+            row[field] = f"{field}-{index % 10}"
+    row.update({
+        'name': f"Name {index}",
+        'status': STATUSES[index % len(STATUSES)],
+        'score': index % 1000,
+        'created': f"2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}",
+        'details': {'tags': [f"tag{index % 7}", f"tag{index % 11}"], 'level': index % 5},
+        'notes': "lorem ipsum " * 16,
+    })
+    return row
+
+
+class SyntheticTable:
+    """Source table for the migration, shaped like an Anvil app table."""
+
+    def __init__(self, fields, size):
+        self._fields = fields
+        self._size = size
+
+    def list_columns(self):
+        columns = [{'name': field, 'type': 'string'} for field in self._fields]
+        columns += [{'name': 'name', 'type': 'string'}, {'name': 'status', 'type': 'string'},
+                    {'name': 'score', 'type': 'number'}, {'name': 'created', 'type': 'string'},
+                    {'name': 'details', 'type': 'simpleObject'}, {'name': 'notes', 'type': 'string'}]
+        return columns
+
+    def search(self, *ordering_and_conditions):
+        """
+        Rows are generated in key order, as the migration requests with order_by.
+        Conditions only matter when resuming, and each benchmark migrates a fresh database.
+        """
+        return (synthetic_row(self._fields, index) for index in range(self._size))
+
+
+def timed(function, repeats):
+    """Calls function(i) `repeats` times and returns the latencies in seconds."""
+    latencies = []
+    for i in range(repeats):
+        started = time.perf_counter()
+        function(i)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def summarize(latencies, rows_per_call=1):
+    """Returns latency percentiles in milliseconds and throughput per second."""
+    ordered = sorted(latencies)
+    total = sum(latencies)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {
+        'calls': len(latencies),
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'calls_per_s': len(latencies) / total if total else float('inf'),
+        'rows_per_s': len(latencies) * rows_per_call / total if total else float('inf'),
+    }
+
+
+def run_size(modules, tables, size, repeats, work_dir):
+    """Migrates the synthetic tables at one size and times the wrapper operations."""
+    uplink_server, migration_script, wrapper = modules
+    use_database(uplink_server, migration_script, os.path.join(work_dir, f"bench_{size}.db"))
+    migration_script.app_tables = types.SimpleNamespace(
+        **{table: SyntheticTable(key_fields(uplink_server, table), size) for table in tables})
+
+    results = []
+    started = time.perf_counter()
+    if not migration_script.migrate_selected_tables(tables):
+        raise RuntimeError("Migration of the synthetic tables failed")
+    elapsed = time.perf_counter() - started
+    results.append({'size': size, 'table': f"{len(tables)} tables", 'operation': 'migration',
+                    **summarize([elapsed], rows_per_call=size * len(tables))})
+
+    rng = random.Random(size)
+    for table_name in tables:
+        table = getattr(wrapper.app_tables, table_name)
+        fields = key_fields(uplink_server, table_name)
+
+        def search(i):
+            list(itertools.islice(table.search(status=rng.choice(STATUSES)), SEARCH_ROWS))
+
+        def text_search(i):
+            # Full-text search for one row's name, through the FTS5 index on tables in FULL_TEXT_COLUMNS
+            list(table.search(name=q.full_text_match(f"name {rng.randrange(size)}")))
+
+        def get(i):
+            row = synthetic_row(fields, rng.randrange(size))
+            table.get(**{field: row[field] for field in fields})
+
+        added = []
+
+        def add_row(i):
+            added.append(table.add_row(**synthetic_row(fields, size * 10 + i)))
+
+        targets = [table.get(**{field: row[field] for field in fields})
+                   for row in (synthetic_row(fields, rng.randrange(size)) for _ in range(repeats))]
+
+        def update_row(i):
+            targets[i].score = i
+
+        def delete(i):
+            added[i].delete()
+
+        for name, function, rows_per_call in [('search', search, min(SEARCH_ROWS, size // len(STATUSES))),
+                                              ('text_search', text_search, 1), ('get', get, 1), ('add_row', add_row, 1),
+                                              ('update_row', update_row, 1), ('delete', delete, 1)]:
+            latencies = timed(function, repeats)
+            results.append({'size': size, 'table': table_name, 'operation': name,
+                            **summarize(latencies, rows_per_call)})
+    return results
+
+
+def print_results(results):
+    header = (f"{'rows':>9} {'table':<24} {'operation':<11} {'calls':>6} {'mean ms':>9} "
+              f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'calls/s':>10} {'rows/s':>11}")
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print(f"{result['size']:>9} {result['table']:<24} {result['operation']:<11} {result['calls']:>6} "
+              f"{result['mean_ms']:>9.3f} {result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} "
+              f"{result['p99_ms']:>9.3f} {result['calls_per_s']:>10.1f} {result['rows_per_s']:>11.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the SQLite wrapper.")
+    parser.add_argument('--sizes', default=','.join(map(str, BENCHMARK_SIZES)),
+                        help="Comma-separated row counts of the synthetic tables")
+    parser.add_argument('--tables', default=','.join(BENCHMARK_TABLES),
+                        help="Comma-separated table names from get_id_field")
+    parser.add_argument('--repeats', type=int, default=OPERATION_REPEATS, help="Timed calls per operation")
+    parser.add_argument('--json', help="Also write the results to this JSON file")
+    parser.add_argument('--keep', action='store_true', help="Keep the temporary databases")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    tables = [table for table in args.tables.split(',') if table]
+    json_path = os.path.abspath(args.json) if args.json else None
+    work_dir = tempfile.mkdtemp(prefix='db_wrapper_bench_')
+    cwd = os.getcwd()
+
+    try:
+        modules = install_local_uplink(work_dir)
+        results = []
+        for size in sizes:
+            print(f"Benchmarking {size} rows...", file=sys.stderr)
+            results.extend(run_size(modules, tables, size, min(args.repeats, size), work_dir))
+        print_results(results)
+        if json_path:
+            with open(json_path, 'w') as f:
+                json.dump(results, f, indent=2)
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Databases kept in {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
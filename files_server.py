@@ -1,5 +1,8 @@
 from flask import Flask, send_from_directory, abort
+from werkzeug.utils import safe_join
+import hashlib
 import os
+import re
 
 app = Flask(__name__)
 
@@ -9,16 +12,55 @@ MEDIA_DIR = "media_files"
 # Ensure the directory exists
 os.makedirs(MEDIA_DIR, exist_ok=True)
 
+# Files stored by content hash (<sha256><ext>) never change, so browsers may cache them forever
+CONTENT_ADDRESSED_NAME = re.compile(r"^[0-9a-f]{64}(\.[A-Za-z0-9]+)?$")
+IMMUTABLE_MAX_AGE = 31536000  # One year, in seconds
+
+# Set to True when running behind a proxy that serves files itself via X-Sendfile.
+# Otherwise files are handed to the WSGI server's file wrapper, which uses sendfile where supported.
+app.config['USE_X_SENDFILE'] = False
+
+# Content hashes of files that are not named by hash, keyed by (path, mtime, size)
+_etag_cache = {}
+
+def media_etag(file_path):
+    """Return the content hash of a media file, for use as its ETag."""
+    name = os.path.basename(file_path)
+    if CONTENT_ADDRESSED_NAME.match(name):
+        return name.split('.')[0]
+
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_mtime_ns, stat.st_size)
+    if key not in _etag_cache:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        _etag_cache[key] = digest.hexdigest()
+    return _etag_cache[key]
+
 @app.route('/media_files/<path:filename>', methods=['GET'])
 def serve_media(filename):
-    """Serve media files."""
-    try:
-        # Serve the file from the media directory
-        return send_from_directory(MEDIA_DIR, filename)
-    except FileNotFoundError:
+    """
+    Serve media files with content-hash ETags and caching headers.
+    Answers If-None-Match with 304 and Range requests with partial content.
+    """
+    media_root = os.path.join(app.root_path, MEDIA_DIR)
+    file_path = safe_join(media_root, filename)
+    if file_path is None or not os.path.isfile(file_path):
         # If the file doesn't exist, return a 404 error
         abort(404)
 
+    immutable = CONTENT_ADDRESSED_NAME.match(os.path.basename(file_path)) is not None
+    response = send_from_directory(media_root, filename, etag=media_etag(file_path), conditional=True,
+                                   max_age=IMMUTABLE_MAX_AGE if immutable else 0)
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        # The file may be replaced under the same name, so revalidate with the ETag every time
+        response.cache_control.no_cache = True
+    return response
+
 @app.route('/')
 def home():
     return "Media server is running. Use /media_files/<filename> to access files."
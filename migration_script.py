@@ -1,8 +1,18 @@
 import sqlite3
 import anvil.server
 import json
+import logging
+import anvil.tables
 from anvil.tables import app_tables
+import anvil.tables.query as q
 import os
+import sys
+import itertools
+import hashlib
+import mimetypes
+import urllib.request
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
 # Define constants
 MEDIA_STORAGE_DIR = "media_files"  # Directory to store media files
@@ -10,39 +20,232 @@ MEDIA_STORAGE_DIR = "media_files"  # Directory to store media files
 # Ensure the media storage directory exists
 os.makedirs(MEDIA_STORAGE_DIR, exist_ok=True)
 
-def save_media_to_file(media_obj, column_name, row_id):
+MEDIA_CHUNK_SIZE = 1024 * 1024  # Bytes written per chunk when storing media
+MEDIA_WORKERS = 8               # Media files downloaded at the same time, across all tables
+MEDIA_DOWNLOAD_TIMEOUT = 60     # Seconds a media download may stall (per connect or read) before it fails
+
+# Shared pool for downloading media files while rows are being migrated
+_media_executor = ThreadPoolExecutor(max_workers=MEDIA_WORKERS)
+
+def iter_media_chunks(media_obj, download=True):
+    """
+    Yield the content of a media object in chunks. Media with a download URL is
+    streamed from it; other media, or any media with `download` False, is sliced
+    from get_bytes().
+    """
+    try:
+        url = media_obj.get_url() if download else None
+    except Exception:
+        url = None
+
+    if url and url.startswith(("http://", "https://")):
+        with urllib.request.urlopen(url, timeout=MEDIA_DOWNLOAD_TIMEOUT) as response:
+            for chunk in iter(lambda: response.read(MEDIA_CHUNK_SIZE), b""):
+                yield chunk
+    else:
+        content = memoryview(media_obj.get_bytes())
+        for start in range(0, len(content), MEDIA_CHUNK_SIZE):
+            yield content[start:start + MEDIA_CHUNK_SIZE]
+
+def media_file_extension(media_obj):
+    """Return the file extension for a media object, from its name or content type."""
+    extension = os.path.splitext(media_obj.name or "")[1]
+    if not extension and media_obj.content_type:
+        extension = mimetypes.guess_extension(media_obj.content_type) or ""
+    return extension if extension[1:].isalnum() else ""
+
+def write_media_file(media_obj, path, download=True):
+    """Write the content of a media object to a file chunk by chunk, returning its SHA-256 hash object."""
+    digest = hashlib.sha256()
+    with open(path, "wb") as f:
+        for chunk in iter_media_chunks(media_obj, download):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest
+
+def save_media_to_file(media_obj):
     """
     Save the media object to a local file and return the file path.
+    Files are named by the SHA-256 of their content, so duplicates are stored
+    once; the content is streamed to a temporary file and renamed once hashed.
     """
     if media_obj is not None:
-        # Generate a unique file name using the row ID and column name
-        file_name = f"{row_id}_{column_name}_{media_obj.name}"
-        file_path = os.path.join(MEDIA_STORAGE_DIR, file_name)
-
-        # Write the media content to the file
-        with open(file_path, "wb") as f:
-            f.write(media_obj.get_bytes())
-        
-        return file_path
+        temp_path = os.path.join(MEDIA_STORAGE_DIR, f".download-{uuid.uuid4().hex}")
+        try:
+            try:
+                digest = write_media_file(media_obj, temp_path)
+            except OSError as e:
+                # The URL may not be open to outside requests (e.g. data table media); get_bytes() goes through Anvil
+                logger.warning("Could not download media, reading it with get_bytes() instead: %s", e)
+                digest = write_media_file(media_obj, temp_path, download=False)
+
+            file_path = os.path.join(MEDIA_STORAGE_DIR, digest.hexdigest() + media_file_extension(media_obj))
+            if os.path.exists(file_path):
+                os.remove(temp_path)  # Same content is already stored
+            else:
+                os.replace(temp_path, file_path)
+            return file_path
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
     return None
 
-# Connect to Anvil Uplink
+# Anvil Uplink key, used when the script is run (see the __main__ block)
 UPLINK_KEY = "6KUJ6DMX7YKU4WZESHXOQ4H4-2U6IUMDW77ZIX6OY"
-anvil.server.connect(UPLINK_KEY)
 
 # Local SQLite Database Path
 LOCAL_DB_PATH = "local.db"
 
+# Progress is logged at INFO level; set to "DEBUG" for a line per migrated chunk
+LOG_LEVEL = "INFO"
+logger = logging.getLogger("migration_script")
+
 
 # Hard-coded list of tables to be migrated
 TABLES_TO_MIGRATE = ["projects","users","candidateprojectmapping","candidates","org","projectrecord","questions","users"]  # Replace with your actual table names
 
+# Rows fetched from Anvil and inserted per transaction
+MIGRATION_CHUNK_SIZE = 500
+# Number of tables migrated at the same time
+MIGRATION_WORKERS = 4
+
+def open_local_connection():
+    """
+    Open a connection to the local SQLite database. WAL mode and a generous busy
+    timeout let the migration workers take turns writing without failing.
+    """
+    conn = sqlite3.connect(LOCAL_DB_PATH, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+def ensure_migration_progress_table(cursor):
+    """Create the table recording per-table migration progress if it does not exist yet."""
+    cursor.execute("CREATE TABLE IF NOT EXISTS _migration_progress "
+                   "(table_name TEXT PRIMARY KEY, rows_done INTEGER NOT NULL, completed INTEGER NOT NULL, "
+                   "last_key TEXT)")
+    cursor.execute("PRAGMA table_info(_migration_progress)")
+    if 'last_key' not in {row[1] for row in cursor.fetchall()}:
+        # Progress table of an earlier version, which only counted rows
+        cursor.execute("ALTER TABLE _migration_progress ADD COLUMN last_key TEXT")
+
+def get_migration_progress(conn, table_name):
+    """
+    Return (rows_done, last_key) for a table: the number of rows already migrated
+    in an unfinished run and the key values of the last one (a list, or None).
+    rows_done is None if the table has not been started in this run, and -1 if it is done.
+    """
+    cursor = conn.cursor()
+    ensure_migration_progress_table(cursor)
+    cursor.execute("SELECT rows_done, completed, last_key FROM _migration_progress WHERE table_name = ?",
+                   (table_name,))
+    row = cursor.fetchone()
+    if row is None:
+        return None, None
+    rows_done, completed, last_key = row
+    return (-1 if completed else rows_done), (json.loads(last_key) if last_key else None)
+
+def record_migration_progress(cursor, table_name, rows_done, last_key=None, completed=False):
+    """Record how far a table has been migrated, as part of the caller's transaction."""
+    cursor.execute("INSERT OR REPLACE INTO _migration_progress (table_name, rows_done, completed, last_key) "
+                   "VALUES (?, ?, ?, ?)",
+                   (table_name, rows_done, int(completed), None if last_key is None else json.dumps(last_key)))
+
+def get_id_field(table_name):
+    """
+    Returns the unique identifier field(s) based on the table name.
+    For tables with composite keys, a list of fields is returned.
+    For single-field primary keys, a string is returned.
+    """
+    id_fields = {
+        'candidates': 'uid',  # Single-field primary key
+        'org': ['proj_uid', 'task'],  # Composite key
+        'projects': 'uid',    # Single-field primary key
+        'users': 'email',     # Single-field primary key
+        'questions': 'uid',   # Single-field primary key
+        'candidateprojectmapping': ['candidate_uid', 'project_uid'],  # Composite key
+        'projectrecord': ['candidate_uid', 'project_uid', 'task']  # Composite key
+    }
+    return id_fields.get(table_name, 'id')  # Default to 'id' (single-field primary key)
+
+# Secondary (non-unique) indexes for columns that are frequently filtered on.
+# Each entry maps a table name to a list of column lists, one per index.
+SECONDARY_INDEXES = {
+    'candidateprojectmapping': [['project_uid']],
+    'projectrecord': [['project_uid']],
+}
+
+def get_index_definitions(table_name):
+    """
+    Returns (index_name, columns, unique) tuples for the indexes of a table:
+    a unique index on the key field(s) from get_id_field, followed by any
+    secondary indexes declared in SECONDARY_INDEXES.
+    """
+    id_fields = get_id_field(table_name)
+    key_columns = [id_fields] if isinstance(id_fields, str) else list(id_fields)
+    definitions = [(f"ux_{table_name}_{'_'.join(key_columns)}", key_columns, True)]
+    for columns in SECONDARY_INDEXES.get(table_name, []):
+        definitions.append((f"idx_{table_name}_{'_'.join(columns)}", list(columns), False))
+    return definitions
+
+def ensure_indexes(conn, table_name):
+    """
+    Create the key and secondary indexes of a table if they do not exist yet.
+    If existing data violates the uniqueness of a key, a plain index is created instead.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    local_columns = {row[1] for row in cursor.fetchall()}
+
+    for index_name, columns, unique in get_index_definitions(table_name):
+        if not set(columns) <= local_columns:
+            # The table does not have the indexed column(s), e.g. the default 'id' key
+            continue
+        column_list = ", ".join(columns)
+        try:
+            cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index_name} "
+                           f"ON {table_name} ({column_list})")
+        except sqlite3.IntegrityError:
+            logger.warning("Duplicate keys in '%s' (%s), creating a non-unique index instead.", table_name, column_list)
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({column_list})")
+    conn.commit()
+
+def bump_table_version(conn, table_name):
+    """
+    Increment the version counter the Uplink server keeps for a table, so that
+    clients with cached rows notice the table was rewritten by the migration.
+    A 'reset' entry in the change log tells clients following the change feed to reload.
+    """
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS _table_versions (table_name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+    cursor.execute("INSERT INTO _table_versions (table_name, version) VALUES (?, 1) "
+                   "ON CONFLICT(table_name) DO UPDATE SET version = version + 1", (table_name,))
+    cursor.execute("CREATE TABLE IF NOT EXISTS _change_log (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                   "table_name TEXT NOT NULL, op TEXT NOT NULL, row_key TEXT)")
+    cursor.execute("INSERT INTO _change_log (table_name, op, row_key) VALUES (?, 'reset', NULL)", (table_name,))
+    conn.commit()
+
+# SQLite type affinity to append to Anvil column types. Without it, "string" and
+# "simpleObject" columns get NUMERIC affinity and text such as "123" is stored as a number.
+ANVIL_TYPE_AFFINITY = {
+    'string': 'TEXT',
+    'simpleObject': 'TEXT',
+}
+
+def column_declaration(anvil_type):
+    """
+    Return the declared SQLite type for an Anvil column type. The Anvil type is
+    kept as the first word so the Uplink server can tell which columns hold JSON.
+    """
+    affinity = ANVIL_TYPE_AFFINITY.get(anvil_type)
+    return f"{anvil_type} {affinity}" if affinity else anvil_type
+
 @anvil.server.callable
 def sync_schema_with_anvil(table_name):
     """
     Synchronize the schema of a specific Anvil table with the local SQLite database.
     """
-    conn = sqlite3.connect(LOCAL_DB_PATH)
+    conn = open_local_connection()
     cursor = conn.cursor()
 
     # Get Anvil table schema and data
@@ -55,105 +258,213 @@ def sync_schema_with_anvil(table_name):
 
     # If the table doesn't exist or is incomplete, recreate or modify it
     if not local_schema:
-        columns = ", ".join(f"{col} {dtype}" for col, dtype in anvil_schema.items())
+        columns = ", ".join(f"{col} {column_declaration(dtype)}" for col, dtype in anvil_schema.items())
         cursor.execute(f"CREATE TABLE {table_name} ({columns})")
-        print(f"Created table '{table_name}' with schema: {anvil_schema}")
+        logger.info("Created table '%s' with schema: %s", table_name, anvil_schema)
     else:
         # Add missing columns
         for col, dtype in anvil_schema.items():
             if col not in local_schema:
-                cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {col} {dtype}")
-                print(f"Added column '{col}' to table '{table_name}'.")
+                cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {col} {column_declaration(dtype)}")
+                logger.info("Added column '%s' to table '%s'.", col, table_name)
 
     conn.commit()
     conn.close()
 
+def search_after_key(anvil_table, key_fields, last_key):
+    """
+    Search an Anvil table in key order, starting after the row with key values
+    `last_key` (a list in key order), or from the first row if it is None.
+    """
+    ordering = [anvil.tables.order_by(field) for field in key_fields]
+    if last_key is None:
+        return anvil_table.search(*ordering)
+
+    # Rows after the key: (k1 > v1) or (k1 = v1 and k2 > v2) or ...
+    after = [q.all_of(**dict(zip(key_fields[:i], last_key[:i])), **{key_fields[i]: q.greater_than(last_key[i])})
+             for i in range(len(key_fields))]
+    return anvil_table.search(*ordering, q.any_of(*after))
+
 @anvil.server.callable
 def migrate_table_data(table_name):
     """
     Migrate all data from a specific Anvil table to the local SQLite database.
+    Rows are streamed from Anvil in key order, in chunks of MIGRATION_CHUNK_SIZE,
+    each inserted with executemany and committed together with the key of its last
+    row, so an interrupted run resumes with the rows after it. Tables that lack
+    their key fields in Anvil are resumed by row count instead.
     """
-    conn = sqlite3.connect(LOCAL_DB_PATH)
+    conn = open_local_connection()
     cursor = conn.cursor()
 
     try:
+        rows_done, last_key = get_migration_progress(conn, table_name)
+        if rows_done == -1:
+            logger.info("Table '%s' was already migrated in this run, skipping.", table_name)
+            return
+
         # Dynamically access the Anvil table using getattr
         anvil_table = getattr(app_tables, table_name)
-        rows = [dict(row) for row in anvil_table.search()]
+        columns = [col['name'] for col in anvil_table.list_columns()]
+        query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+        id_fields = get_id_field(table_name)
+        key_fields = [id_fields] if isinstance(id_fields, str) else list(id_fields)
+        if not set(key_fields) <= set(columns):
+            key_fields = None
 
-        if rows:
-            # Get column names and prepare SQL for insertion
-            columns = ", ".join(rows[0].keys())
-            placeholders = ", ".join("?" for _ in rows[0])
+        if rows_done and key_fields and last_key is None:
+            # Progress of an earlier version, counted in rows of an unknown order
+            logger.info("Restarting migration of '%s', its progress has no key to resume from.", table_name)
+            rows_done = None
 
-            # Clear the local table
+        if rows_done is None:
+            # Fresh start: clear the local table
             cursor.execute(f"DELETE FROM {table_name}")
+            rows_done, last_key = 0, None
+            record_migration_progress(cursor, table_name, rows_done)
+            conn.commit()
+        else:
+            logger.info("Resuming migration of '%s' after %d rows.", table_name, rows_done)
 
-            # Insert data into the local table
-            query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-            for row_id, row in enumerate(rows, start=1):
-                processed_row = []
+        if key_fields:
+            # Stream rows lazily in key order, after the last row committed by an interrupted run
+            rows = search_after_key(anvil_table, key_fields, last_key)
+        else:
+            # No key to order by: skip as many rows as were committed, which relies on
+            # Anvil returning them in the same order as in the interrupted run
+            logger.warning("Table '%s' has no key fields %s in Anvil; resuming by row count.",
+                           table_name, get_id_field(table_name))
+            rows = itertools.islice(anvil_table.search(), rows_done, None)
+
+        while True:
+            chunk = list(itertools.islice(rows, MIGRATION_CHUNK_SIZE))
+            if not chunk:
+                break
 
-                for column, value in row.items():
-                    # Handle media files
+            processed_rows = []
+            for row in chunk:
+                processed_row = []
+                for column in columns:
+                    value = row[column]
+                    # Handle media files, downloaded concurrently
                     if isinstance(value, anvil.Media):
-                        file_path = save_media_to_file(value, column, row_id)
-                        processed_row.append(file_path)
+                        processed_row.append(_media_executor.submit(save_media_to_file, value))
                     # Serialize unsupported types
                     elif isinstance(value, (dict, list)):
                         processed_row.append(json.dumps(value))
                     else:
                         processed_row.append(value)
-                
-                # Insert the processed row into the local database
-                cursor.execute(query, tuple(processed_row))
-            
-            print(f"Migrated {len(rows)} rows to table '{table_name}'.")
+                processed_rows.append(processed_row)
 
-        else:
-            print(f"No data found in table '{table_name}' to migrate.")
+            # Wait for the chunk's media files and put their paths in place
+            processed_rows = [tuple(value.result() if isinstance(value, Future) else value for value in row)
+                              for row in processed_rows]
 
-        # Commit changes
+            # Insert the chunk and record progress in the same transaction
+            cursor.executemany(query, processed_rows)
+            rows_done += len(chunk)
+            if key_fields:
+                last_key = [chunk[-1][field] for field in key_fields]
+            record_migration_progress(cursor, table_name, rows_done, last_key)
+            conn.commit()
+            logger.debug("Migrated %d rows to table '%s'.", rows_done, table_name)
+
+        record_migration_progress(cursor, table_name, rows_done, last_key, completed=True)
         conn.commit()
+        logger.info("Data migrated for table '%s' (%d rows).", table_name, rows_done)
 
     except Exception as e:
-        print(f"Error while migrating table '{table_name}': {e}")
-    print(f"Data migrated for table '{table_name}'.")
-    conn.commit()
-    conn.close()
-    
+        conn.rollback()
+        logger.error("Error while migrating table '%s': %s", table_name, e)
+        raise
+    finally:
+        conn.close()
+
+
+def migrate_table(table_name):
+    """Sync the schema, migrate the data and build the indexes of one table."""
+    logger.info("Processing table: %s", table_name)
+
+    # Sync schema
+    sync_schema_with_anvil(table_name)
+
+    # Migrate data
+    migrate_table_data(table_name)
+
+    conn = open_local_connection()
+    try:
+        # Build key and secondary indexes once the data is in place
+        ensure_indexes(conn, table_name)
+
+        # Invalidate client-side caches of the table
+        bump_table_version(conn, table_name)
+    finally:
+        conn.close()
+
 
 @anvil.server.callable
 def migrate_selected_tables(tables):
     """
-    Migrate only the selected tables from Anvil to the local SQLite database.
+    Migrate only the selected tables from Anvil to the local SQLite database,
+    several at a time on a pool of MIGRATION_WORKERS threads.
+    Returns True if every table was migrated. Progress of a failed or interrupted
+    run is kept, so running the migration again resumes it.
     """
-    conn = sqlite3.connect(LOCAL_DB_PATH)
-    cursor = conn.cursor()
+    tables = list(dict.fromkeys(tables))  # Drop duplicates, keeping order
+    failed = []
 
-    for table_name in tables:
-        print(f"Processing table: {table_name}")
+    with ThreadPoolExecutor(max_workers=MIGRATION_WORKERS) as executor:
+        futures = {executor.submit(migrate_table, table_name): table_name for table_name in tables}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failed.append(futures[future])
+                logger.error("Migration of table '%s' failed: %s", futures[future], e)
 
-        # Sync schema
-        sync_schema_with_anvil(table_name)
+    if failed:
+        logger.error("Migration incomplete, failed tables: %s. Run the script again to resume.", failed)
+        return False
 
-        # Migrate data
-        migrate_table_data(table_name)
+    # Every table is done: clear the progress so the next run starts afresh
+    conn = open_local_connection()
+    try:
+        cursor = conn.cursor()
+        ensure_migration_progress_table(cursor)
+        cursor.execute("DELETE FROM _migration_progress")
+        conn.commit()
+    finally:
+        conn.close()
+    logger.info("Migration for selected tables completed successfully.")
 
-    conn.close()
-    print("Migration for selected tables completed successfully.")
+    # Let a running Uplink server reload its schema registry (best effort)
+    try:
+        anvil.server.call('refresh_schema')
+    except Exception as e:
+        logger.warning("Could not refresh the Uplink server's schema (is it running?): %s", e)
+    return True
 
 # Call the functions directly within the script
 if __name__ == "__main__":
-    print("Starting migration process for selected tables...")
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    # Connect to Anvil Uplink
+    anvil.server.connect(UPLINK_KEY)
+
+    logger.info("Starting migration process for selected tables...")
 
     # Call the migration for the specified tables
-    migrate_selected_tables(TABLES_TO_MIGRATE)
+    succeeded = migrate_selected_tables(TABLES_TO_MIGRATE)
+
+    if succeeded:
+        logger.info("Migration process completed successfully.")
 
-    print("Migration process completed successfully.")
-    
     # Example: Print data from a specific table (optional)
     # print_table_data("example_table_name")
 
-# Wait forever to keep the server alive for remote calls (optional)
-anvil.server.wait_forever()
\ No newline at end of file
+    if "--serve" in sys.argv:
+        # Keep the script alive for remote calls to the migration functions (optional)
+        anvil.server.wait_forever()
+
+    anvil.server.disconnect()
+    sys.exit(0 if succeeded else 1)
@@ -0,0 +1,515 @@
+"""
+Tests for the wrapper and the Uplink server, run against the in-process Uplink
+stand-in from benchmark.py and a temporary SQLite database per test.
+
+Usage:
+    python -m pytest -q
+"""
+import json
+import os
+import types
+
+import anvil
+import anvil.server
+import anvil.tables
+import pytest
+from anvil.tables import query as q
+
+import benchmark
+
+
+class ListTable:
+    """
+    Source table for the migration holding the given rows, shaped like an Anvil app
+    table. Rows are kept in key order, as the migration requests with order_by.
+    """
+
+    def __init__(self, columns, rows):
+        self._columns = columns
+        self.rows = rows
+        self.fail_after = None  # Raise after returning this many rows from a search
+        self.returned = 0       # Rows returned by searches so far
+
+    def list_columns(self):
+        return [{'name': name, 'type': anvil_type} for name, anvil_type in self._columns.items()]
+
+    def search(self, *ordering_and_conditions):
+        conditions = [arg for arg in ordering_and_conditions if not isinstance(arg, anvil.tables.order_by)]
+        for row in self.rows:
+            if all(matches(row, condition) for condition in conditions):
+                if self.fail_after is not None and self.returned >= self.fail_after:
+                    raise ConnectionError("Anvil is unavailable")
+                self.returned += 1
+                yield row
+
+
+def matches(row, condition):
+    """Evaluates the all_of / any_of / greater_than conditions built by migration_script.search_after_key."""
+    clauses = [matches(row, arg) for arg in condition.args]
+    for field, value in condition.kwargs.items():
+        if isinstance(value, type(q.greater_than(0))):
+            clauses.append(row[field] is not None and row[field] > value.value)
+        else:
+            clauses.append(row[field] == value)
+    return any(clauses) if isinstance(condition, type(q.any_of())) else all(clauses)
+
+
+@pytest.fixture(scope="module")
+def modules(tmp_path_factory):
+    cwd = os.getcwd()
+    modules = benchmark.install_local_uplink(str(tmp_path_factory.mktemp("uplink")))
+    yield modules
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def load_table(modules, tmp_path):
+    """Returns a function that migrates a table with the given columns and rows, and returns its wrapper Table."""
+    uplink_server, migration_script, wrapper = modules
+    benchmark.use_database(uplink_server, migration_script, str(tmp_path / "test.db"))
+    source_tables = {}
+    migration_script.app_tables = types.SimpleNamespace()
+
+    def load(table_name, columns, rows):
+        source_tables[table_name] = ListTable(columns, rows)
+        migration_script.app_tables = types.SimpleNamespace(**source_tables)
+        assert migration_script.migrate_selected_tables([table_name])
+        return getattr(wrapper.app_tables, table_name)
+    return load
+
+
+MAPPING_COLUMNS = {'candidate_uid': 'string', 'project_uid': 'string', 'status': 'string', 'score': 'number'}
+
+
+def mapping_rows(count, empty_keys=0):
+    """Rows of candidateprojectmapping; the first `empty_keys` rows have no candidate_uid."""
+    return [{'candidate_uid': None if i < empty_keys else f"c{i:02d}", 'project_uid': f"p{i:02d}",
+             'status': 'new' if i % 2 else 'done', 'score': i} for i in range(count)]
+
+
+@pytest.mark.parametrize("page_size", [1, 3, 5, 50])
+def test_search_pages_past_empty_key_fields(load_table, page_size):
+    table = load_table('candidateprojectmapping', MAPPING_COLUMNS, mapping_rows(12, empty_keys=5))
+
+    rows = list(table.search(q.page_size(page_size)))
+
+    assert sorted(row['project_uid'] for row in rows) == [f"p{i:02d}" for i in range(12)]
+    assert len(table.search(q.page_size(page_size))) == 12
+
+
+def test_migration_callables_are_registered(modules):
+    assert 'migrate_table_data' in benchmark._callables
+    assert 'search_after_key' not in benchmark._callables
+
+
+def project_uids(rows):
+    return sorted(row['project_uid'] for row in rows)
+
+
+def test_search_conditions_treat_none_like_anvil(load_table):
+    rows = mapping_rows(6)
+    rows[0]['status'] = None
+    rows[1]['score'] = None
+    table = load_table('candidateprojectmapping', MAPPING_COLUMNS, rows)
+
+    assert project_uids(table.search(status=None)) == ['p00']
+    assert project_uids(table.search(status=['new', None])) == ['p00', 'p01', 'p03', 'p05']
+    assert project_uids(table.search(score=q.greater_than(None))) == []
+    # A comparison with NULL counts as no match, so not_ keeps the row
+    assert project_uids(table.search(q.not_(status='done'))) == ['p00', 'p01', 'p03', 'p05']
+    assert project_uids(table.search(score=q.not_(q.less_than(4)))) == ['p01', 'p04', 'p05']
+    assert project_uids(table.search(q.any_of(status='new', score=q.greater_than_or_equal_to(4)))) == \
+        ['p01', 'p03', 'p04', 'p05']
+
+
+def test_search_order_by_pages_through_nulls(load_table):
+    rows = mapping_rows(10)
+    for i in (2, 5, 6):
+        rows[i]['score'] = None
+    table = load_table('candidateprojectmapping', MAPPING_COLUMNS, rows)
+
+    for ascending in (True, False):
+        found = [row['project_uid'] for row in
+                 table.search(anvil.tables.order_by('score', ascending=ascending), q.page_size(2))]
+        # SQLite sorts NULLs first ascending and last descending; ties follow the key
+        expected = sorted(rows, key=lambda row: (row['score'] is not None, row['score'] or 0, row['project_uid']))
+        if not ascending:
+            expected = sorted(rows, key=lambda row: (row['score'] is None, -(row['score'] or 0), row['project_uid']))
+        assert found == [row['project_uid'] for row in expected]
+
+
+def test_synced_rows_follow_the_change_feed(load_table):
+    table = load_table('candidateprojectmapping', MAPPING_COLUMNS, mapping_rows(6))
+    synced = table.sync(status='new')
+    assert project_uids(synced) == ['p01', 'p03', 'p05']
+
+    table.add_row(candidate_uid='c10', project_uid='p10', status='new', score=10)
+    table.get(candidate_uid='c03', project_uid='p03').status = 'done'
+    table.get(candidate_uid='c05', project_uid='p05').delete()
+    table.get(candidate_uid='c01', project_uid='p01').score = 100
+
+    changed = synced.refresh()
+
+    assert sorted(changed) == [('c01', 'p01'), ('c03', 'p03'), ('c05', 'p05'), ('c10', 'p10')]
+    assert project_uids(synced) == project_uids(table.search(status='new')) == ['p01', 'p10']
+    assert synced[0]['score'] == 100
+    assert synced.refresh() == []
+
+
+@pytest.mark.parametrize("wire_format,compress_min_bytes", [(None, 0), ('columnar', 10 ** 9), ('columnar', 0)])
+def test_pack_rows_round_trip(modules, monkeypatch, wire_format, compress_min_bytes):
+    uplink_server, _, wrapper = modules
+    monkeypatch.setattr(uplink_server, 'COMPRESS_MIN_BYTES', compress_min_bytes)
+    rows = [{'id': 1, 'values': [1, 2], 'encoding': 'utf-8'}, None, {'id': 2, 'values': None, 'encoding': None}]
+
+    packed = uplink_server.pack_rows(rows, wire_format, compress=True)
+
+    if wire_format and compress_min_bytes == 0:
+        assert packed['encoding'] == 'zlib'
+    assert wrapper._unpack_rows(json.loads(json.dumps(packed))) == rows
+
+
+FILE_COLUMNS = {'id': 'number', 'encoding': 'string', 'rows': 'simpleObject'}
+
+
+def test_rows_shaped_like_packed_results_are_returned(modules, load_table):
+    uplink_server = modules[0]
+    table = load_table('files', FILE_COLUMNS, [])
+    returned = uplink_server.ROWS_RETURNED._series
+
+    row = table.add_row(id=1, encoding='utf-8', rows=[4, 5, 6, 7])
+    assert row['encoding'] == 'utf-8'
+    assert anvil.server.call('get_row_by_id', 'files', 1)['rows'] == [4, 5, 6, 7]
+    assert returned[(('function', 'get_row_by_id'), ('table', 'files'))][-1] == 1
+    assert table.aggregate({'values': ('count', None), 'rows': ('sum', 'id')}) == {'values': 1, 'rows': 1}
+    assert table.get(id=1)['encoding'] == 'utf-8'
+
+
+CANDIDATE_COLUMNS = {'uid': 'string', 'name': 'string', 'status': 'string', 'score': 'number'}
+
+
+def candidate_rows(count):
+    return [{'uid': f"u{i:02d}", 'name': f"Name {i}", 'status': 'new' if i % 2 else 'done', 'score': i}
+            for i in range(count)]
+
+
+@pytest.fixture
+def cached_table(modules, load_table, monkeypatch):
+    """Returns a function that loads a table with the row cache enabled and version checks held off."""
+    wrapper = modules[2]
+    monkeypatch.setattr(wrapper, '_row_caches', {})
+    monkeypatch.setattr(wrapper, 'CACHE_VERSION_CHECK_INTERVAL', 10 ** 9)
+
+    def load(table_name, columns, rows):
+        table = load_table(table_name, columns, rows)
+        table.enable_cache()
+        return table
+    return load
+
+
+def test_cache_drops_a_row_under_its_old_key(cached_table):
+    table = cached_table('candidates', CANDIDATE_COLUMNS, candidate_rows(4))
+    row = table.get(uid='u01')
+
+    row.uid = 'u09'
+
+    assert table.get(uid='u01') is None
+    assert table.get(uid='u09')['name'] == 'Name 1'
+
+
+def test_cache_drops_search_results_after_writes(cached_table):
+    table = cached_table('candidates', CANDIDATE_COLUMNS, candidate_rows(4))
+    assert table.count(status='new') == 2
+    assert [row['uid'] for row in table.search(status='new')] == ['u01', 'u03']
+
+    table.add_row(uid='u05', name='Name 5', status='new', score=5)
+    assert table.count(status='new') == 3
+    table.get(uid='u01').status = 'done'
+    assert [row['uid'] for row in table.search(status='new')] == ['u03', 'u05']
+    table.get(uid='u03').delete()
+    assert table.count(status='new') == 1
+    assert table.get(uid='u03') is None
+
+
+def test_transaction_applies_writes_in_one_call(modules, load_table):
+    wrapper = modules[2]
+    table = load_table('candidates', CANDIDATE_COLUMNS, candidate_rows(4))
+    first, second = table.get(uid='u00'), table.get(uid='u01')
+    wrapper.reset_metrics()
+
+    with wrapper.transaction:
+        first.score = 100
+        first.status = 'new'
+        second.delete()
+        assert table.get(uid='u00')['score'] == 0  # Not stored until the block exits
+
+    assert wrapper.get_metrics()['apply_batch']['calls'] == 1
+    assert table.get(uid='u00')['score'] == 100
+    assert table.get(uid='u01') is None
+
+
+def test_transaction_restores_rows_when_the_block_raises(modules, load_table):
+    wrapper = modules[2]
+    table = load_table('candidates', CANDIDATE_COLUMNS, candidate_rows(4))
+    row = table.get(uid='u00')
+
+    with pytest.raises(RuntimeError):
+        with wrapper.transaction:
+            row.score = 100
+            assert row['score'] == 100
+            raise RuntimeError("discard the batch")
+
+    assert row['score'] == 0
+    assert table.get(uid='u00')['score'] == 0
+
+
+def test_transaction_rolls_back_when_the_server_fails(modules, load_table):
+    wrapper = modules[2]
+    table = load_table('candidates', CANDIDATE_COLUMNS, candidate_rows(4))
+    first, second = table.get(uid='u00'), table.get(uid='u01')
+
+    with pytest.raises(Exception):
+        with wrapper.transaction:
+            first.score = 100
+            second.uid = 'u02'  # Violates the unique key index
+
+    assert (first['score'], second['uid']) == (0, 'u01')
+    assert table.get(uid='u00')['score'] == 0
+    assert table.get(uid='u01') is not None
+
+
+def test_add_rows_keeps_the_chunks_stored_before_a_failure(modules, cached_table, monkeypatch):
+    wrapper = modules[2]
+    table = cached_table('candidates', CANDIDATE_COLUMNS, candidate_rows(10))
+    replicated = []
+    monkeypatch.setattr(wrapper, 'ADD_ROWS_CHUNK_SIZE', 1)
+    monkeypatch.setattr(wrapper, '_replicate', lambda kind, table_name, primary_key=None, values=None:
+                        replicated.append(values['uid']))
+    assert table.count() == 10
+
+    with pytest.raises(Exception):
+        table.add_rows([{'uid': 'u10'}, {'uid': 'u11'}, {'uid': 'u00'}])  # The last key already exists
+
+    assert table.count() == 12
+    assert replicated == ['u10', 'u11']
+
+
+class FlakyAnvilTable:
+    """Stand-in for an Anvil app table whose add_row raises for the first `failures` calls."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.added = []
+
+    def add_row(self, **values):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Anvil is unavailable")
+        self.added.append(values['uid'])
+
+
+@pytest.fixture
+def anvil_copy(modules, monkeypatch):
+    """Returns a function that enables replication to a FlakyAnvilTable standing in for 'candidates'."""
+    wrapper = modules[2]
+    monkeypatch.setattr(wrapper, 'REPLICATE_TO_ANVIL', True)
+    monkeypatch.setattr(wrapper, 'REPLICATION_BATCH_DELAY', 0)
+    monkeypatch.setattr(wrapper, 'REPLICATION_RETRY_DELAY', 0)
+    monkeypatch.setattr(wrapper, '_replication_queue', wrapper._ReplicationQueue())
+
+    def replicate_to(failures):
+        anvil_table = FlakyAnvilTable(failures)
+        monkeypatch.setattr(wrapper, 'original_app_tables', types.SimpleNamespace(candidates=anvil_table))
+        return anvil_table
+    return replicate_to
+
+
+def test_replication_retries_failed_writes_in_order(modules, load_table, anvil_copy):
+    wrapper = modules[2]
+    table = load_table('candidates', CANDIDATE_COLUMNS, [])
+    anvil_table = anvil_copy(failures=2)
+
+    table.add_row(uid='u00')
+    table.add_row(uid='u01')
+
+    assert wrapper.flush_replication(timeout=10)
+    assert anvil_table.added == ['u00', 'u01']
+    assert wrapper.replication_failures() == 0
+
+
+def test_replication_keeps_writes_that_keep_failing(modules, load_table, anvil_copy):
+    wrapper = modules[2]
+    table = load_table('candidates', CANDIDATE_COLUMNS, [])
+    anvil_table = anvil_copy(failures=wrapper.REPLICATION_RETRIES + 1)
+
+    table.add_row(uid='u00')
+    assert wrapper.flush_replication(timeout=10)
+
+    assert wrapper.replication_failures() == 1
+    assert wrapper.failed_replications()[0]['values'] == {'uid': 'u00'}
+    assert wrapper.retry_failed_replications() == 1
+    assert wrapper.flush_replication(timeout=10)
+    assert anvil_table.added == ['u00']
+    assert wrapper.replication_failures() == 0
+
+
+def test_synchronous_replication_raises(modules, load_table, anvil_copy, monkeypatch):
+    wrapper = modules[2]
+    table = load_table('candidates', CANDIDATE_COLUMNS, [])
+    anvil_copy(failures=1)
+    monkeypatch.setattr(wrapper, 'REPLICATE_ASYNC', False)
+
+    with pytest.raises(ConnectionError):
+        table.add_row(uid='u00')
+
+
+def test_migration_resumes_after_the_last_migrated_key(modules, load_table, monkeypatch):
+    _, migration_script, wrapper = modules
+    load_table('candidates', CANDIDATE_COLUMNS, [])  # Starts a fresh database
+    source = ListTable(CANDIDATE_COLUMNS, candidate_rows(10))
+    migration_script.app_tables = types.SimpleNamespace(candidates=source)
+    monkeypatch.setattr(migration_script, 'MIGRATION_CHUNK_SIZE', 3)
+
+    source.fail_after = 7
+    assert not migration_script.migrate_selected_tables(['candidates'])  # Two chunks of three rows committed
+
+    # A row that was already migrated is removed from Anvil before the run resumes
+    source.rows = [row for row in source.rows if row['uid'] != 'u02']
+    source.fail_after, source.returned = None, 0
+    assert migration_script.migrate_selected_tables(['candidates'])
+
+    assert source.returned == 4  # Only the rows after u05 are downloaded again
+    assert [row['uid'] for row in wrapper.app_tables.candidates.search()] == [f"u{i:02d}" for i in range(10)]
+
+
+class UnreachableMedia(anvil.BlobMedia):
+    """Media whose URL can not be downloaded from outside Anvil, as with some data table media."""
+
+    def get_url(self, *args, **kwargs):
+        return "http://127.0.0.1:9/_/serve/media"
+
+
+@pytest.mark.parametrize("save", ['uplink_server', 'migration_script'])
+def test_media_falls_back_to_get_bytes_when_the_download_fails(modules, save):
+    uplink_server, migration_script, _ = modules
+    save_media = uplink_server.save_media if save == 'uplink_server' else migration_script.save_media_to_file
+
+    path = save_media(UnreachableMedia("text/plain", b"media content", name="notes.txt"))
+
+    with open(path, 'rb') as f:
+        assert f.read() == b"media content"
+    assert path.endswith(".txt")
+
+
+def test_synced_rows_reload_after_rows_without_key_values(load_table):
+    table = load_table('candidates', CANDIDATE_COLUMNS, candidate_rows(10))
+    synced = table.sync(score=q.greater_than(3))
+    assert len(synced) == 6
+
+    table.add_rows([{'name': 'x', 'score': 9}])
+    table.add_row(name='y', score=8)
+
+    assert synced.refresh() is None  # Rows without a key can only be picked up by a reload
+    assert len(synced) == len(table.search(score=q.greater_than(3))) == 8
+
+
+def test_get_many_returns_rows_in_key_order(load_table, monkeypatch, modules):
+    uplink_server = modules[0]
+    monkeypatch.setattr(uplink_server, 'GET_MANY_CHUNK_SIZE', 2)  # Spreads the keys over several statements
+    table = load_table('candidates', CANDIDATE_COLUMNS, candidate_rows(6))
+
+    rows = table.get_many(['u04', 'missing', 'u01', 'u04', 'u05'])
+
+    assert [row and row['uid'] for row in rows] == ['u04', None, 'u01', 'u04', 'u05']
+    assert table.get_many([]) == []
+
+
+def test_get_many_with_composite_keys_and_projection(load_table):
+    table = load_table('candidateprojectmapping', MAPPING_COLUMNS, mapping_rows(4))
+
+    rows = table.get_many([('c02', 'p02'), {'candidate_uid': 'c00', 'project_uid': 'p00'}, ('c02', 'p00')],
+                          q.fetch_only('status'))
+
+    assert [row and row['project_uid'] for row in rows] == ['p02', 'p00', None]
+    assert rows[0]['score'] == 2  # Loaded by key when first read
+
+
+def test_get_many_serves_cached_rows(modules, cached_table):
+    wrapper = modules[2]
+    table = cached_table('candidates', CANDIDATE_COLUMNS, candidate_rows(4))
+    table.get_many(['u01', 'u02'])
+    wrapper.reset_metrics()
+
+    rows = table.get_many(['u02', 'u01'])
+
+    assert [row['uid'] for row in rows] == ['u02', 'u01']
+    assert 'get_rows_by_keys' not in wrapper.get_metrics()
+
+
+TEXT_ROWS = [{'uid': f"u{i:02d}", 'name': name, 'status': name, 'score': i} for i, name in enumerate(
+    ["Ünïcode Ärger", "ada lovelace", "Ada Byron", "50% off_sale", "Running fast", "500 offers"])]
+
+
+def names(rows):
+    return sorted(row['name'] for row in rows)
+
+
+@pytest.mark.parametrize("pattern,glob", [
+    ("%ada_%", "*ada?*"),
+    ("50\\% off\\_%", "50% off_*"),
+    ("a*b?[c]", "a[*]b[?][[]c]"),
+    ("trailing\\", "trailing\\"),
+])
+def test_like_pattern_to_glob(modules, pattern, glob):
+    assert modules[0].like_pattern_to_glob(pattern) == glob
+
+
+# 'name' is in FULL_TEXT_COLUMNS for candidates and has FTS5 indexes; 'status' holds the same text unindexed
+@pytest.mark.parametrize("field", ['name', 'status'])
+def test_like_and_ilike(load_table, field):
+    table = load_table('candidates', CANDIDATE_COLUMNS, TEXT_ROWS)
+
+    def search(condition):
+        return names(table.search(**{field: condition}))
+
+    assert search(q.like("Ada%")) == ["Ada Byron"]
+    assert search(q.ilike("ada%")) == ["Ada Byron", "ada lovelace"]
+    assert search(q.like("%e_a%")) == ["ada lovelace"]
+    assert search(q.like("50\\% off\\_%")) == ["50% off_sale"]
+    assert search(q.ilike("%OFF%")) == ["50% off_sale", "500 offers"]
+    assert search(q.ilike("ünï%")) == ["Ünïcode Ärger"]
+    assert search(q.ilike("%ÄRG%")) == ["Ünïcode Ärger"]
+    assert search(q.like("ünï%")) == []
+
+
+@pytest.mark.parametrize("field", ['name', 'status'])
+def test_full_text_match(load_table, field):
+    table = load_table('candidates', CANDIDATE_COLUMNS, TEXT_ROWS)
+
+    def search(query):
+        return names(table.search(**{field: q.full_text_match(query)}))
+
+    assert search("ADA") == ["Ada Byron", "ada lovelace"]
+    assert search("ada byron") == ["Ada Byron"]
+    assert search("ärger") == ["Ünïcode Ärger"]
+    assert search("") == []
+
+
+def test_full_text_match_uses_the_word_index(load_table):
+    table = load_table('candidates', CANDIDATE_COLUMNS, TEXT_ROWS)
+
+    assert names(table.search(name=q.full_text_match("run"))) == ["Running fast"]  # Stemmed by the index
+    assert names(table.search(name=q.full_text_match("ada OR fast", raw=True))) == \
+        ["Ada Byron", "Running fast", "ada lovelace"]
+    with pytest.raises(Exception):
+        list(table.search(status=q.full_text_match("ada", raw=True)))  # Raw queries need an index
+
+
+def test_text_search_scans_when_an_index_can_not_be_built(modules, load_table, monkeypatch):
+    uplink_server = modules[0]
+    monkeypatch.setattr(uplink_server, 'FULL_TEXT_TOKENIZER', "no_such_tokenizer")
+    table = load_table('candidates', CANDIDATE_COLUMNS, TEXT_ROWS)
+
+    assert 'fts' not in uplink_server._full_text_indexes['candidates']
+    assert names(table.search(name=q.full_text_match("ada"))) == ["Ada Byron", "ada lovelace"]
+    assert names(table.search(name=q.ilike("%BYR%"))) == ["Ada Byron"]
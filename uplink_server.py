@@ -1,11 +1,210 @@
 import anvil.server
 import sqlite3
 import json
-from flask import Flask, send_from_directory, abort
+import logging
+import time
+from flask import Flask, Response, send_from_directory, abort
+from werkzeug.utils import safe_join
 import threading
 import os
 import socket
-
+import queue
+import re
+import hashlib
+import mimetypes
+import urllib.request
+import uuid
+import base64
+import zlib
+import functools
+import itertools
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Use orjson for decoding JSON columns when it is installed
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    json_loads = json.loads
+    json_dumps = lambda value: json.dumps(value, default=str).encode()
+
+
+logger = logging.getLogger("uplink_server")
+
+# Logging and metrics
+LOG_LEVEL = "INFO"              # Set to "DEBUG" to log every call and SQL statement (values are never logged)
+SLOW_QUERY_MS = 200             # SQL statements slower than this are logged as warnings; None disables the log
+MEASURE_RESPONSE_BYTES = False  # Also measure results pack_rows did not encode, with an extra encode per call
+SQLITE_PROGRESS_STEPS = 1000    # SQLite VM instructions between progress callbacks, used to measure work per statement
+
+# Upper bounds of the histogram buckets
+DURATION_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+
+class Histogram:
+    """Thread-safe histogram with fixed buckets per label set, rendered in the Prometheus text format."""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}  # Sorted label items -> [count per bucket..., total count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = ",".join(f'{name}="{value}"' for name, value in key)
+                prefix = labels + "," if labels else ""
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-2]}')
+                lines.append(f"{self.name}_count{{{labels}}} {series[-2]}")
+                lines.append(f"{self.name}_sum{{{labels}}} {series[-1]}")
+        return "\n".join(lines)
+
+
+class Counter:
+    """Thread-safe counter per label set, rendered in the Prometheus text format."""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                labels = ",".join(f'{name}="{value}"' for name, value in key)
+                lines.append(f"{self.name}{{{labels}}} {value}")
+        return "\n".join(lines)
+
+
+CALL_DURATION = Histogram("uplink_call_duration_ms", "Time spent in Uplink callables, in milliseconds", DURATION_BUCKETS_MS)
+SQL_DURATION = Histogram("sql_duration_ms", "Time spent executing and fetching SQL statements, in milliseconds",
+                         DURATION_BUCKETS_MS)
+SQL_VM_STEPS = Histogram("sql_vm_steps", "SQLite VM instructions per statement (a proxy for rows scanned), "
+                         f"counted in steps of {SQLITE_PROGRESS_STEPS}", COUNT_BUCKETS)
+ROWS_RETURNED = Histogram("rows_returned", "Rows (or keys) returned per Uplink call", COUNT_BUCKETS)
+RESPONSE_BYTES = Histogram("response_bytes", "Encoded size of Uplink call results, in bytes", COUNT_BUCKETS)
+CALL_ERRORS = Counter("uplink_call_errors_total", "Uplink calls that raised an exception")
+SLOW_QUERIES = Counter("sql_slow_queries_total", "SQL statements slower than SLOW_QUERY_MS")
+METRICS = [CALL_DURATION, SQL_DURATION, SQL_VM_STEPS, ROWS_RETURNED, RESPONSE_BYTES, CALL_ERRORS, SLOW_QUERIES]
+
+# The callable running on the current Uplink thread, and the SQLite VM progress it has made
+_call_context = threading.local()
+
+def _count_vm_steps():
+    """SQLite progress handler: counts VM instructions run on this thread. Returning 0 lets the statement continue."""
+    _call_context.vm_steps = getattr(_call_context, 'vm_steps', 0) + 1
+    return 0
+
+def record_rows_returned(count):
+    """Records the number of rows (or keys) the running callable returns, for the rows returned metric."""
+    _call_context.rows_returned = count
+
+def instrumented(function):
+    """
+    Records the duration, rows returned (see record_rows_returned), response size and
+    errors of an Uplink callable in the metrics (the size of rows encoded by pack_rows, or of any
+    result with MEASURE_RESPONSE_BYTES), and logs each call at DEBUG level. The first
+    argument of the callable is taken as the table name label.
+    """
+    name = function.__name__
+
+    @functools.wraps(function)
+    def timed_call(*args, **kwargs):
+        table = args[0] if args and isinstance(args[0], str) else kwargs.get('table_name', '')
+        _call_context.function = name
+        _call_context.vm_steps = 0
+        _call_context.response_bytes = None
+        _call_context.rows_returned = 0
+        started = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            CALL_ERRORS.inc(function=name, table=table)
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            CALL_DURATION.observe(elapsed_ms, function=name, table=table)
+            _call_context.function = None
+
+        # Counted by the callable itself (see record_rows_returned), as the shape of a
+        # result can not tell rows apart from row values or aggregate results
+        rows = _call_context.rows_returned
+        ROWS_RETURNED.observe(rows, function=name, table=table)
+        # Rows compressed by pack_rows were already encoded, so their size comes for free
+        size = _call_context.response_bytes
+        if size is None and MEASURE_RESPONSE_BYTES:
+            try:
+                size = len(json_dumps(result))
+            except TypeError:
+                pass  # Results with values JSON cannot encode are sent by the Uplink but not measured
+        if size is not None:
+            RESPONSE_BYTES.observe(size, function=name, table=table)
+        logger.debug("call function=%s table=%s ms=%.2f rows=%d bytes=%s", name, table, elapsed_ms, rows, size)
+        return result
+    return timed_call
+
+def _record_statement(sql, started, steps_before, values_count):
+    """Records a statement's time and VM work, and logs it (slow ones as warnings)."""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    function = getattr(_call_context, 'function', None) or 'other'
+    steps = (getattr(_call_context, 'vm_steps', 0) - steps_before) * SQLITE_PROGRESS_STEPS
+    SQL_DURATION.observe(elapsed_ms, function=function)
+    SQL_VM_STEPS.observe(steps, function=function)
+    if SLOW_QUERY_MS is not None and elapsed_ms >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc(function=function)
+        logger.warning("slow query function=%s ms=%.1f vm_steps=%d values=%d sql=%s",
+                       function, elapsed_ms, steps, values_count, sql)
+    else:
+        logger.debug("sql function=%s ms=%.2f vm_steps=%d values=%d sql=%s",
+                     function, elapsed_ms, steps, values_count, sql)
+
+def execute(cur, sql, params=()):
+    """Executes a statement, recording it in the SQL metrics."""
+    started, steps_before = time.perf_counter(), getattr(_call_context, 'vm_steps', 0)
+    cur.execute(sql, params)
+    _record_statement(sql, started, steps_before, len(params))
+    return cur
+
+def execute_many(cur, sql, rows):
+    """Executes a statement once per row of values, recording it in the SQL metrics as one statement."""
+    started, steps_before = time.perf_counter(), getattr(_call_context, 'vm_steps', 0)
+    cur.executemany(sql, rows)
+    _record_statement(sql, started, steps_before, len(rows))
+    return cur
+
+def fetch_rows(cur, sql, params=()):
+    """Executes a query and fetches all its rows, recording both in the SQL metrics."""
+    started, steps_before = time.perf_counter(), getattr(_call_context, 'vm_steps', 0)
+    rows = cur.execute(sql, params).fetchall()
+    _record_statement(sql, started, steps_before, len(params))
+    return rows
 
 
 # Flask app setup
@@ -13,18 +212,64 @@ app = Flask(__name__)
 MEDIA_DIR = "media_files"
 os.makedirs(MEDIA_DIR, exist_ok=True)
 
+# Files stored by content hash (<sha256><ext>) never change, so browsers may cache them forever
+CONTENT_ADDRESSED_NAME = re.compile(r"^[0-9a-f]{64}(\.[A-Za-z0-9]+)?$")
+IMMUTABLE_MAX_AGE = 31536000  # One year, in seconds
+
+# Set to True when running behind a proxy that serves files itself via X-Sendfile.
+# Otherwise files are handed to the WSGI server's file wrapper, which uses sendfile where supported.
+app.config['USE_X_SENDFILE'] = False
+
+# Content hashes of files that are not named by hash, keyed by (path, mtime, size)
+_etag_cache = {}
+
+def media_etag(file_path):
+    """Returns the content hash of a media file, for use as its ETag."""
+    name = os.path.basename(file_path)
+    if CONTENT_ADDRESSED_NAME.match(name):
+        return name.split('.')[0]
+
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_mtime_ns, stat.st_size)
+    if key not in _etag_cache:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        _etag_cache[key] = digest.hexdigest()
+    return _etag_cache[key]
+
 @app.route('/media_files/<path:filename>', methods=['GET'])
 def serve_media(filename):
-    """Serve media files."""
-    try:
-        return send_from_directory(MEDIA_DIR, filename)
-    except FileNotFoundError:
+    """
+    Serve media files with content-hash ETags and caching headers.
+    Answers If-None-Match with 304 and Range requests with partial content.
+    """
+    media_root = os.path.join(app.root_path, MEDIA_DIR)
+    file_path = safe_join(media_root, filename)
+    if file_path is None or not os.path.isfile(file_path):
         abort(404)
 
+    immutable = CONTENT_ADDRESSED_NAME.match(os.path.basename(file_path)) is not None
+    response = send_from_directory(media_root, filename, etag=media_etag(file_path), conditional=True,
+                                   max_age=IMMUTABLE_MAX_AGE if immutable else 0)
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        # The file may be replaced under the same name, so revalidate with the ETag every time
+        response.cache_control.no_cache = True
+    return response
+
 @app.route('/')
 def home():
     return "Media server and Uplink are running."
 
+@app.route('/metrics')
+def metrics():
+    """Exposes the call and SQL metrics in the Prometheus text format."""
+    body = "\n".join(metric.render() for metric in METRICS) + "\n"
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
 # Flask server in a separate thread
 def run_flask():
     app.run(host="0.0.0.0", port=8000)
@@ -34,15 +279,50 @@ UPLINK_KEY = "6KUJ6DMX7YKU4WZESHXOQ4H4-2U6IUMDW77ZIX6OY"
 # Path to your SQLite database
 DB_PATH = "local.db"
 
-# Connect to Anvil's Uplink
-anvil.server.connect(UPLINK_KEY)
-
-def get_connection():
-    """Returns a new connection to the SQLite database."""
-    conn = sqlite3.connect(DB_PATH)
+# SQLite connection tuning
+CONNECTION_POOL_SIZE = 16      # Idle connections kept open for reuse
+SQLITE_BUSY_TIMEOUT_MS = 5000  # How long a writer waits for the database lock before failing
+SQLITE_CACHE_TOTAL_KB = 131072  # Page cache shared out among the pooled connections (128 MB)
+SQLITE_CACHE_SIZE_KB = SQLITE_CACHE_TOTAL_KB // CONNECTION_POOL_SIZE  # Page cache per connection
+SQLITE_CACHED_STATEMENTS = 256  # Prepared statements kept per connection
+
+# Idle connections shared by the Uplink worker threads. The Uplink starts a new
+# thread for every call, so connections are pooled rather than kept per thread.
+_connection_pool = queue.LifoQueue(maxsize=CONNECTION_POOL_SIZE)
+
+def casefold(value):
+    """SQL function casefold(x): folds the case of text (all of Unicode, unlike LIKE); other values pass through."""
+    return value.casefold() if isinstance(value, str) else value
+
+def open_connection():
+    """Opens a new connection to the SQLite database in WAL mode with tuned pragmas."""
+    conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                           cached_statements=SQLITE_CACHED_STATEMENTS)
     conn.row_factory = sqlite3.Row  # To allow dict-like row access
+    conn.execute("PRAGMA journal_mode=WAL")  # Readers no longer block behind writers
+    conn.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, avoids an fsync per commit
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")  # Negative value is in KiB
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    conn.set_progress_handler(_count_vm_steps, SQLITE_PROGRESS_STEPS)  # Measures work per statement
+    conn.create_function("casefold", 1, casefold, deterministic=True)  # Case-insensitive matching beyond ASCII
     return conn
 
+def get_connection():
+    """Checks out a connection to the SQLite database, reusing an idle one if available."""
+    try:
+        return _connection_pool.get_nowait()
+    except queue.Empty:
+        return open_connection()
+
+def release_connection(conn):
+    """Returns a connection to the pool, rolling back any unfinished transaction."""
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _connection_pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
 def get_id_field(table_name):
     """
     Returns the unique identifier field(s) based on the table name.
@@ -60,16 +340,882 @@ def get_id_field(table_name):
     }
     return id_fields.get(table_name, 'id')  # Default to 'id' (single-field primary key)
 
+# Secondary (non-unique) indexes for columns that are frequently filtered on.
+# Keep in sync with SECONDARY_INDEXES in migration_script.py.
+SECONDARY_INDEXES = {
+    'candidateprojectmapping': [['project_uid']],
+    'projectrecord': [['project_uid']],
+}
+
+def get_index_definitions(table_name):
+    """
+    Returns (index_name, columns, unique) tuples for the indexes of a table:
+    a unique index on the key field(s) from get_id_field, followed by any
+    secondary indexes declared in SECONDARY_INDEXES.
+    """
+    id_fields = get_id_field(table_name)
+    key_columns = [id_fields] if isinstance(id_fields, str) else list(id_fields)
+    definitions = [(f"ux_{table_name}_{'_'.join(key_columns)}", key_columns, True)]
+    for columns in SECONDARY_INDEXES.get(table_name, []):
+        definitions.append((f"idx_{table_name}_{'_'.join(columns)}", list(columns), False))
+    return definitions
+
+def ensure_metadata_tables():
+    """Creates the bookkeeping tables used by the server if they do not exist yet."""
+    conn = get_connection()
+    try:
+        # Version counter per table, bumped by every write so clients can detect stale caches
+        conn.execute("CREATE TABLE IF NOT EXISTS _table_versions (table_name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        # Change feed: one entry per written row, numbered by a sequence that only grows
+        conn.execute("CREATE TABLE IF NOT EXISTS _change_log (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                     "table_name TEXT NOT NULL, op TEXT NOT NULL, row_key TEXT)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx__change_log_table_seq ON _change_log (table_name, seq)")
+        conn.commit()
+    finally:
+        release_connection(conn)
+
+def bump_table_version(cur, table_name):
+    """Increments the version counter of a table, as part of the caller's write transaction."""
+    cur.execute("INSERT INTO _table_versions (table_name, version) VALUES (?, 1) "
+                "ON CONFLICT(table_name) DO UPDATE SET version = version + 1", (table_name,))
+
+# Number of change log entries kept; older entries are pruned, and clients that
+# fall further behind are told to reload (see changes_since)
+CHANGE_LOG_MAX_ROWS = 100000
+# Changes recorded between two prunes of the change log
+CHANGE_LOG_PRUNE_EVERY = 1000
+_changes_since_prune = 0
+
+def record_changes(cur, table_name, op, keys):
+    """
+    Appends entries to the change log as part of the caller's write transaction.
+    `op` is 'upsert' (row added or changed) or 'delete', and `keys` holds the key
+    values of each row, as lists in key order. Rows can only be synced by a
+    complete key, so writes to tables without key fields, or to rows with an
+    empty key field (e.g. added without their key values), are recorded as a
+    'reset' instead.
+    """
+    global _changes_since_prune
+    if not get_table_schema(cur, table_name).key_columns or any(None in key for key in keys):
+        keys, op = [None], 'reset'
+    execute_many(cur, "INSERT INTO _change_log (table_name, op, row_key) VALUES (?, ?, ?)",
+                 [(table_name, op, None if key is None else json.dumps(list(key))) for key in keys])
+
+    _changes_since_prune += len(keys)
+    if _changes_since_prune >= CHANGE_LOG_PRUNE_EVERY:
+        _changes_since_prune = 0
+        execute(cur, "DELETE FROM _change_log WHERE seq <= (SELECT MAX(seq) FROM _change_log) - ?",
+                (CHANGE_LOG_MAX_ROWS,))
+
+def row_key(schema, row):
+    """Returns the key values of a stored row, in key order."""
+    return [row[column] for column in schema.key_columns]
 
 @anvil.server.callable
-def fetch_all_rows(table_name):
-    """Fetches all rows from the given table."""
+@instrumented
+def get_change_seq():
+    """Returns the sequence number of the latest change, to start following the change feed from."""
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(f"SELECT * FROM {table_name}")
-    rows = cur.fetchall()
-    # Deserialize JSON fields if applicable
-    return [{k: json.loads(v) if isinstance(v, str) and v.startswith('{') else v for k, v in dict(row).items()} for row in rows]
+    try:
+        rows = fetch_rows(conn.cursor(), "SELECT seq FROM sqlite_sequence WHERE name = '_change_log'")
+        return rows[0][0] if rows else 0
+    finally:
+        release_connection(conn)
+
+@anvil.server.callable
+@instrumented
+def changes_since(table_name, seq, query=None, limit=1000):
+    """
+    Returns the rows of a table that changed after change number `seq`:
+    {'changes': [{'key': [...], 'row': row or None}], 'seq': n, 'more': bool, 'reset': bool}.
+    Several changes to one row are merged into its current state. 'row' is None
+    if the row was deleted or, when a serialized `query` is given, no longer
+    matches it. Pass the returned 'seq' to the next call; 'more' means further
+    changes are waiting. 'reset' means the changes can not be replayed (the log
+    was pruned past `seq`, or the table was rewritten), so the client must reload.
+    """
+    conn = get_connection()
+
+    try:
+        cur = conn.cursor()
+        schema = get_table_schema(cur, table_name, query_fields(query))
+        latest = fetch_rows(cur, "SELECT seq FROM sqlite_sequence WHERE name = '_change_log'")
+        latest = latest[0][0] if latest else 0
+        oldest = fetch_rows(cur, "SELECT MIN(seq) FROM _change_log")[0][0]
+        if seq > latest or (oldest is not None and seq < oldest - 1):
+            return {'changes': [], 'seq': latest, 'more': False, 'reset': True}
+
+        entries = fetch_rows(cur, "SELECT seq, op, row_key FROM _change_log WHERE table_name = ? AND seq > ? "
+                                  "ORDER BY seq LIMIT ?", (table_name, seq, limit))
+        more = len(entries) == limit
+        next_seq = entries[-1]['seq'] if more else latest
+        if any(entry['op'] == 'reset' for entry in entries):
+            return {'changes': [], 'seq': next_seq, 'more': False, 'reset': True}
+
+        # Only the current state of each changed row is sent, so repeated changes collapse
+        changed_keys = list(dict.fromkeys(entry['row_key'] for entry in entries))
+
+        params = []
+        where_clause = compile_query(query, schema.columns, params, table_name) if query else None
+        keys = [json.loads(key) for key in changed_keys]
+        found = {}
+        for row in fetch_rows_by_keys(cur, table_name, keys, where_clause=where_clause, where_params=params):
+            row_data = deserialize_row(row, schema)
+            found[row_data.pop('_wanted_pos')] = row_data
+
+        changes = [{'key': key, 'row': found.get(position)} for position, key in enumerate(keys)]
+        record_rows_returned(len(changes))
+        return {'changes': changes, 'seq': next_seq, 'more': more, 'reset': False}
+
+    except Exception as e:
+        logger.error("Error while reading changes: %s", e)
+        raise
+    finally:
+        release_connection(conn)
+
+@anvil.server.callable
+@instrumented
+def get_table_version(table_name):
+    """Returns the version counter of a table, which changes whenever the table is written to."""
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT version FROM _table_versions WHERE table_name = ?", (table_name,)).fetchone()
+        return row[0] if row else 0
+    finally:
+        release_connection(conn)
+
+# Suffixes of the shadow tables in which FTS5 stores an index
+FTS5_SHADOW_SUFFIXES = ('data', 'idx', 'docsize', 'config', 'content')
+
+def full_text_tables(cur):
+    """Returns the names of the full-text index tables and their shadow tables."""
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%'")
+    virtual = {row[0] for row in cur.fetchall()}
+    return virtual | {f"{name}_{suffix}" for name in virtual for suffix in FTS5_SHADOW_SUFFIXES}
+
+def list_data_tables(cur):
+    """
+    Returns the names of the tables that hold rows: not the server's own
+    '_'-prefixed bookkeeping tables, nor full-text indexes and their shadow tables.
+    """
+    internal = full_text_tables(cur)
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+    return [row[0] for row in cur.fetchall() if not row[0].startswith('_') and row[0] not in internal]
+
+def ensure_indexes():
+    """
+    Checks that every data table has its key and secondary indexes, creating any
+    that are missing. Called once when the server starts.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        tables = list_data_tables(cur)
+
+        # Earlier versions also indexed the shadow tables of full-text indexes, which
+        # only slowed down their writes. FTS5 creates no indexes of its own there.
+        internal = full_text_tables(cur)
+        cur.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+        for index_name in [row[0] for row in cur.fetchall() if row[1] in internal]:
+            cur.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+        for table_name in tables:
+            cur.execute(f"PRAGMA table_info({table_name})")
+            local_columns = {row[1] for row in cur.fetchall()}
+
+            for index_name, columns, unique in get_index_definitions(table_name):
+                if not set(columns) <= local_columns:
+                    # The table does not have the indexed column(s), e.g. the default 'id' key
+                    continue
+                column_list = ", ".join(columns)
+                try:
+                    cur.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index_name} "
+                                f"ON {table_name} ({column_list})")
+                except sqlite3.IntegrityError:
+                    logger.warning("Duplicate keys in '%s' (%s), creating a non-unique index instead.",
+                                   table_name, column_list)
+                    cur.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({column_list})")
+        conn.commit()
+    finally:
+        release_connection(conn)
+
+# Text columns searchable through FTS5 indexes with q.full_text_match, q.like and q.ilike.
+# Each entry maps a table name to its indexed columns; columns the table lacks are skipped.
+# Conditions on other columns still work, but scan the table.
+FULL_TEXT_COLUMNS = {
+    'candidates': ['name', 'email'],
+    'projects': ['name', 'description'],
+    'questions': ['question'],
+}
+# Word index used by full_text_match: case- and accent-insensitive, with English stemming
+FULL_TEXT_TOKENIZER = "porter unicode61 remove_diacritics 2"
+# Also keep a trigram index of the columns, so like / ilike patterns with a leading % use an index
+FULL_TEXT_TRIGRAMS = True
+
+# Full-text indexed columns by table and index kind ('fts' or 'trigram'), as built by ensure_full_text_indexes
+_full_text_indexes = {}
+
+def full_text_index_sql(table_name, index_name, columns, tokenizer):
+    """
+    Returns the statements that create an external-content FTS5 index over
+    columns of a table, and the triggers that keep it in sync with every write
+    to the table (Uplink callables, batches and the migration alike).
+    """
+    column_list = ", ".join(columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    delete = (f"INSERT INTO {index_name} ({index_name}, rowid, {column_list}) "
+              f"VALUES ('delete', old.rowid, {old_values});")
+    insert = f"INSERT INTO {index_name} (rowid, {column_list}) VALUES (new.rowid, {new_values});"
+    return [
+        f"CREATE VIRTUAL TABLE {index_name} USING fts5({column_list}, content='{table_name}', "
+        f"content_rowid='rowid', tokenize='{tokenizer}')",
+        f"CREATE TRIGGER {index_name}_ai AFTER INSERT ON {table_name} BEGIN {insert} END",
+        f"CREATE TRIGGER {index_name}_ad AFTER DELETE ON {table_name} BEGIN {delete} END",
+        f"CREATE TRIGGER {index_name}_au AFTER UPDATE OF {column_list} ON {table_name} BEGIN {delete} {insert} END",
+    ]
+
+def drop_full_text_index(cur, index_name):
+    """Drops an FTS5 index and its sync triggers, if they exist."""
+    for trigger in ('ai', 'ad', 'au'):
+        cur.execute(f"DROP TRIGGER IF EXISTS {index_name}_{trigger}")
+    cur.execute(f"DROP TABLE IF EXISTS {index_name}")
+
+def ensure_full_text_indexes():
+    """
+    Creates the FTS5 indexes declared in FULL_TEXT_COLUMNS. An index that is
+    missing or covers other columns is (re)built from the table's rows; indexes
+    no longer wanted are dropped. Called when the server starts and on refresh_schema.
+    """
+    tokenizers = {'fts': FULL_TEXT_TOKENIZER, 'trigram': 'trigram'}
+    indexes = {}
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        for table_name, wanted in FULL_TEXT_COLUMNS.items():
+            cur.execute(f"PRAGMA table_info({table_name})")
+            local_columns = {row[1] for row in cur.fetchall()}
+            columns = [column for column in wanted if column in local_columns]
+
+            for kind, tokenizer in tokenizers.items():
+                index_name = f"{table_name}_{kind}"
+                if not columns or (kind == 'trigram' and not FULL_TEXT_TRIGRAMS):
+                    drop_full_text_index(cur, index_name)
+                    continue
+                statements = full_text_index_sql(table_name, index_name, columns, tokenizer)
+                cur.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (index_name,))
+                existing = cur.fetchone()
+                if existing is None or existing[0] != statements[0]:
+                    # Builds without FTS5, or older than 3.34 for the trigram tokenizer, cannot
+                    # create the index; its conditions then scan the table instead
+                    cur.execute(f"SAVEPOINT {index_name}")
+                    try:
+                        drop_full_text_index(cur, index_name)
+                        for statement in statements:
+                            cur.execute(statement)
+                        cur.execute(f"INSERT INTO {index_name} ({index_name}) VALUES ('rebuild')")
+                    except sqlite3.OperationalError as e:
+                        cur.execute(f"ROLLBACK TO {index_name}")
+                        logger.warning("Could not build %s index '%s' with SQLite %s, scanning the table instead: %s",
+                                       kind, index_name, sqlite3.sqlite_version, e)
+                        continue
+                    finally:
+                        cur.execute(f"RELEASE {index_name}")
+                    logger.info("Built %s index '%s' on %s.", kind, index_name, columns)
+                indexes.setdefault(table_name, {})[kind] = set(columns)
+        conn.commit()
+    finally:
+        release_connection(conn)
+
+    _full_text_indexes.clear()
+    _full_text_indexes.update(indexes)
+
+
+def deserialize_row(row, schema):
+    """
+    Converts a sqlite3.Row into a dict, decoding JSON only in columns whose Anvil
+    type says they hold JSON. Columns without an Anvil type (tables not created
+    by the migration) fall back to decoding strings that look like JSON objects or arrays.
+    """
+    row_data = dict(row)
+    for column, value in row_data.items():
+        if not isinstance(value, str):
+            continue
+        if column in schema.json_columns or (column in schema.untyped_columns and value[:1] in ('{', '[')):
+            try:
+                row_data[column] = json_loads(value)
+            except ValueError:
+                pass  # Scalars stored as plain text are returned as they are
+    return row_data
+
+
+# Column names, declared types and key columns of a table, as held in the schema registry.
+# json_columns are the columns decoded as JSON; untyped_columns have no Anvil type.
+TableSchema = namedtuple('TableSchema', ['columns', 'types', 'key_columns', 'json_columns', 'untyped_columns'])
+
+# Anvil column types, used by the migration as the declared SQLite column types
+ANVIL_COLUMN_TYPES = {'string', 'number', 'bool', 'date', 'datetime', 'simpleobject', 'media',
+                      'link_single', 'link_multiple'}
+# Anvil (or plain SQLite) column types whose values are stored as JSON text
+JSON_COLUMN_TYPES = {'simpleobject', 'json'}
+
+# Schemas of the tables in the database, loaded once at startup instead of per call
+_schema_registry = {}
+_schema_lock = threading.Lock()
+
+def load_table_schema(cur, table_name):
+    """Reads the schema of a table from SQLite. Returns None if the table does not exist."""
+    cur.execute(f"PRAGMA table_info({table_name})")
+    info = cur.fetchall()
+    if not info:
+        return None
+    columns = [row[1] for row in info]  # Column names are in the second field
+    types = {row[1]: row[2] for row in info}  # Declared types (the Anvil column types) in the third
+    id_fields = get_id_field(table_name)
+    key_columns = [id_fields] if isinstance(id_fields, str) else list(id_fields)
+
+    # The first word of the declared type is the Anvil type, e.g. "simpleObject TEXT"
+    base_types = {column: (declared.split() or [''])[0].lower() for column, declared in types.items()}
+    json_columns = {column for column, base in base_types.items() if base in JSON_COLUMN_TYPES}
+    untyped_columns = {column for column, base in base_types.items()
+                       if base not in ANVIL_COLUMN_TYPES and base not in JSON_COLUMN_TYPES}
+    return TableSchema(columns, types, [column for column in key_columns if column in columns],
+                       json_columns, untyped_columns)
+
+def refresh_schema_registry():
+    """Reloads the schema of every data table into the registry."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        registry = {table_name: load_table_schema(cur, table_name) for table_name in list_data_tables(cur)}
+    finally:
+        release_connection(conn)
+
+    with _schema_lock:
+        _schema_registry.clear()
+        _schema_registry.update(registry)
+    return registry
+
+@anvil.server.callable
+def refresh_schema():
+    """
+    Reloads the schema registry, e.g. after a migration changed the tables, and
+    builds full-text indexes for tables created since. Returns the table names.
+    """
+    ensure_full_text_indexes()
+    return sorted(refresh_schema_registry())
+
+def get_table_schema(cur, table_name, needed_columns=()):
+    """
+    Returns the registered schema of a table. The table is reloaded from SQLite
+    if it is not registered yet or lacks one of `needed_columns`, which picks up
+    tables and columns added since the registry was loaded.
+    """
+    schema = _schema_registry.get(table_name)
+    if schema is None or not set(needed_columns) <= set(schema.columns):
+        schema = load_table_schema(cur, table_name)
+        if schema is None:
+            raise ValueError(f"Table '{table_name}' does not exist")
+        with _schema_lock:
+            _schema_registry[table_name] = schema
+    return schema
+
+def get_table_columns(cur, table_name, needed_columns=()):
+    """Returns the column names of the given table, raising if the table does not exist."""
+    return get_table_schema(cur, table_name, needed_columns).columns
+
+def query_fields(node):
+    """Returns the column names referenced by a serialized query tree."""
+    if not node:
+        return set()
+    if 'args' in node:
+        return set().union(*(query_fields(arg) for arg in node['args']))
+    return {node['field']}
+
+def select_columns(cur, table_name, columns=None, exclude_columns=None):
+    """
+    Resolves a column projection into (select list, omitted columns). `columns`
+    limits the result to the given columns and `exclude_columns` leaves columns
+    out; key columns are always selected so rows can still be updated and paged.
+    Unknown columns in `columns` raise, so typos do not silently return less data.
+    """
+    if not columns and not exclude_columns:
+        return "*", []
+    schema = get_table_schema(cur, table_name, columns or ())
+    unknown = set(columns or ()) - set(schema.columns)
+    if unknown:
+        raise ValueError(f"Unknown columns for table '{table_name}': {sorted(unknown)}")
+    selected = [column for column in schema.columns
+                if column in schema.key_columns
+                or ((not columns or column in columns) and column not in (exclude_columns or ()))]
+    omitted = [column for column in schema.columns if column not in selected]
+    return ", ".join(selected), omitted
+
+
+# Statement text is built once per table and column set, so identical SQL is reused
+# and hits sqlite3's per-connection prepared statement cache.
+
+@functools.lru_cache(maxsize=1024)
+def key_where_sql(table_name):
+    """Returns the WHERE clause text that identifies a row by its primary key(s)."""
+    id_fields = get_id_field(table_name)
+    if isinstance(id_fields, str):
+        return f"{id_fields} = ?"
+    return " AND ".join(f"{field} = ?" for field in id_fields)
+
+@functools.lru_cache(maxsize=1024)
+def insert_sql(table_name, columns):
+    """Returns the INSERT statement text for a table and a tuple of columns."""
+    return f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+
+@functools.lru_cache(maxsize=1024)
+def update_sql(table_name, columns):
+    """Returns the UPDATE-by-key statement text for a table and a tuple of columns."""
+    return f"UPDATE {table_name} SET {', '.join(f'{column} = ?' for column in columns)} WHERE {key_where_sql(table_name)}"
+
+@functools.lru_cache(maxsize=1024)
+def delete_sql(table_name):
+    """Returns the DELETE-by-key statement text for a table."""
+    return f"DELETE FROM {table_name} WHERE {key_where_sql(table_name)}"
+
+@functools.lru_cache(maxsize=1024)
+def select_by_key_sql(table_name, select_list="*"):
+    """Returns the SELECT-by-key statement text for a table and select list."""
+    return f"SELECT {select_list} FROM {table_name} WHERE {key_where_sql(table_name)}"
+
+
+# Comparison operators accepted in serialized queries, mapped to their SQL form
+COMPARISON_OPERATORS = {'=': '=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+
+
+# Words of a full_text_match query that is not raw
+FULL_TEXT_WORD = re.compile(r"\w+")
+
+
+def escape_like(text):
+    """Escapes the LIKE wildcards in text, for use with ESCAPE '\\'."""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def like_pattern_to_glob(pattern):
+    """
+    Translates a LIKE pattern, with backslash escapes as in Anvil (Postgres),
+    into the equivalent GLOB pattern, which SQLite matches case-sensitively.
+    """
+    glob = []
+    escaped = False
+    for char in pattern:
+        if escaped or char not in "\\%_":
+            glob.append(f"[{char}]" if char in "*?[" else char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        else:
+            glob.append("*" if char == "%" else "?")
+    if escaped:
+        glob.append("\\")  # A trailing backslash matches itself
+    return "".join(glob)
+
+
+def full_text_match_sql(table_name, field, query, raw, params):
+    """
+    Compiles q.full_text_match on a column. Indexed columns are matched through the
+    table's FTS5 word index: every word must occur (stemmed, ignoring case), and a
+    raw query is passed to FTS5 as is, in FTS5 query syntax. Other columns fall back
+    to a substring test per word, ignoring case, which scans the table.
+    """
+    words = FULL_TEXT_WORD.findall(query or "")
+    if field in _full_text_indexes.get(table_name, {}).get('fts', ()):
+        if not raw and not words:
+            return "0"
+        match = query if raw else " ".join(f'"{word}"' for word in words)
+        params.append(f"{field} : ({match})")
+        return f"rowid IN (SELECT rowid FROM {table_name}_fts WHERE {table_name}_fts MATCH ?)"
+
+    if raw:
+        raise ValueError(f"Column '{field}' has no full-text index for raw queries, see FULL_TEXT_COLUMNS")
+    if not words:
+        return "0"
+    params.extend(f"%{escape_like(word.casefold())}%" for word in words)
+    return "(" + " AND ".join(f"casefold({field}) LIKE ? ESCAPE '\\'" for _ in words) + ")"
+
+
+def like_sql(table_name, field, pattern, case_sensitive, params):
+    """
+    Compiles q.like (case_sensitive) or q.ilike on a column. On columns with a
+    trigram index, the index finds the rows matching the pattern regardless of
+    case, which is the ilike result; like additionally checks case with GLOB.
+    The index (like SQLite's LIKE) ignores case only for ASCII letters, so ilike
+    patterns with other characters are matched with casefold() instead, scanning
+    the table. Patterns with backslash escapes bypass the index, which has no
+    ESCAPE support.
+    """
+    clauses = []
+    indexed = field in _full_text_indexes.get(table_name, {}).get('trigram', ()) and "\\" not in pattern
+    if indexed and (case_sensitive or pattern.isascii()):
+        clauses.append(f"rowid IN (SELECT rowid FROM {table_name}_trigram WHERE {field} LIKE ?)")
+        params.append(pattern)
+        if not case_sensitive:
+            return clauses[0]
+    if case_sensitive:
+        clauses.append(f"{field} GLOB ?")
+        params.append(like_pattern_to_glob(pattern))
+    else:
+        clauses.append(f"casefold({field}) LIKE ? ESCAPE '\\'")
+        params.append(pattern.casefold())
+    return "(" + " AND ".join(clauses) + ")"
+
+
+def compile_query(node, columns, params, table_name=None):
+    """
+    Compiles a serialized query tree (as produced by wrapper.Table) into a
+    parameterized SQL WHERE clause. Values are appended to `params`;
+    column names are checked against `columns` so they can be inlined safely.
+    `table_name` lets full-text conditions use the table's FTS5 indexes.
+
+    Nodes are dicts of the form:
+    - {'op': 'and' | 'or' | 'not', 'args': [node, ...]}
+    - {'op': '=' | '<' | '<=' | '>' | '>=', 'field': name, 'value': value}
+    - {'op': 'in', 'field': name, 'values': [value, ...]}
+    - {'op': 'full_text_match', 'field': name, 'query': text, 'raw': bool}
+    - {'op': 'like' | 'ilike', 'field': name, 'pattern': pattern}
+    """
+    op = node['op']
+
+    # Boolean combinations of sub-queries
+    if op in ('and', 'or', 'not'):
+        parts = [compile_query(arg, columns, params, table_name) for arg in node['args']]
+        if op == 'and':
+            return "(" + " AND ".join(parts) + ")" if parts else "1"
+        if op == 'or':
+            return "(" + " OR ".join(parts) + ")" if parts else "0"
+        # not_ matches none of its arguments. A comparison with NULL is unknown in SQL,
+        # which NOT would keep unknown; it counts as "no match", as in Anvil.
+        return "NOT (" + " OR ".join(f"COALESCE(({part}), 0)" for part in parts) + ")" if parts else "1"
+
+    field = node['field']
+    if field not in columns:
+        raise ValueError(f"Unknown column '{field}' in query")
+
+    if op == 'in':
+        values = [serialize_value(value) for value in node['values']]
+        non_null = [value for value in values if value is not None]
+        clauses = []
+        if non_null:
+            clauses.append(f"{field} IN ({', '.join('?' for _ in non_null)})")
+            params.extend(non_null)
+        if len(non_null) != len(values):
+            clauses.append(f"{field} IS NULL")
+        return "(" + " OR ".join(clauses) + ")" if clauses else "0"
+
+    if op == 'full_text_match':
+        return full_text_match_sql(table_name, field, node['query'], node.get('raw', False), params)
+    if op in ('like', 'ilike'):
+        return like_sql(table_name, field, node['pattern'], op == 'like', params)
+
+    if op not in COMPARISON_OPERATORS:
+        raise ValueError(f"Unsupported query operator: {op}")
+
+    value = serialize_value(node['value'])
+    if value is None:
+        # Only equality is meaningful against NULL; ordering comparisons never match
+        return f"{field} IS NULL" if op == '=' else "0"
+    params.append(value)
+    return f"{field} {COMPARISON_OPERATORS[op]} ?"
+
+
+def serialize_value(value):
+    """Serializes complex types like lists or dictionaries the same way they are stored."""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+# Columnar results of at least this many encoded bytes are compressed when the caller allows it
+COMPRESS_MIN_BYTES = 64 * 1024
+COMPRESSION_LEVEL = 1  # zlib level: fast, and most of the gain on repetitive row data
+
+def pack_rows(rows, wire_format=None, compress=False):
+    """
+    Encodes a list of row dicts (or None entries) for sending over the Uplink.
+    - wire_format None: the list of dicts as it is.
+    - wire_format 'columnar': {'columns': [...], 'values': [[...] per row, or None]},
+      so column names are sent once instead of once per row.
+    With `compress`, columnar results of COMPRESS_MIN_BYTES or more are sent as
+    {'encoding': 'zlib', 'data': base64 of the zlib-compressed JSON, 'count': rows} instead.
+    """
+    record_rows_returned(len(rows))
+    if wire_format is None:
+        return rows
+    if wire_format != 'columnar':
+        raise ValueError(f"Unsupported wire format: {wire_format}")
+
+    columns = next((list(row) for row in rows if row is not None), [])
+    packed = {'columns': columns,
+              'values': [None if row is None else list(row.values()) for row in rows]}
+    if compress:
+        try:
+            encoded = json_dumps(packed)
+        except TypeError:
+            return packed  # Values JSON cannot encode are left to the Uplink's own serialization
+        _call_context.response_bytes = len(encoded)  # Measured for the response size metric
+        if len(encoded) >= COMPRESS_MIN_BYTES:
+            data = base64.b64encode(zlib.compress(encoded, COMPRESSION_LEVEL)).decode('ascii')
+            _call_context.response_bytes = len(data)
+            return {'encoding': 'zlib', 'data': data, 'count': len(rows)}
+    return packed
+
+@anvil.server.callable
+@instrumented
+def fetch_all_rows(table_name, columns=None, wire_format=None, compress=False):
+    """
+    Fetches all rows from the given table, optionally only the given columns.
+    `wire_format` and `compress` select the result encoding (see pack_rows).
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        schema = get_table_schema(cur, table_name)  # Raises if the table does not exist
+        select_list, _ = select_columns(cur, table_name, columns)
+        rows = fetch_rows(cur, f"SELECT {select_list} FROM {table_name}")
+        # Deserialize JSON fields if applicable
+        return pack_rows([deserialize_row(row, schema) for row in rows], wire_format, compress)
+    finally:
+        release_connection(conn)
+
+
+def get_page_key_columns(cur, table_name):
+    """
+    Returns the columns used to order and paginate a table: the key field(s)
+    from get_id_field that exist in the table, with the rowid as a tie-breaker.
+    """
+    return get_table_schema(cur, table_name).key_columns + ['rowid']
+
+
+def get_sort_columns(cur, table_name, order_by=None):
+    """
+    Returns the (column, ascending) pairs a page is ordered by: the requested
+    order_by columns followed by the page key columns, which make the order
+    total so the keyset cursor never skips or repeats rows.
+    """
+    columns = get_table_columns(cur, table_name, [column for column, _ in order_by or ()])
+    sort_columns = []
+    for column, ascending in order_by or ():
+        if column not in columns:
+            raise ValueError(f"Unknown column: {column}")
+        sort_columns.append((column, bool(ascending)))
+    sorted_names = {column for column, _ in sort_columns}
+    sort_columns.extend((column, True) for column in get_page_key_columns(cur, table_name)
+                        if column not in sorted_names)
+    return sort_columns
+
+
+def keyset_after_sql(sort_columns, cursor, params):
+    """
+    Builds the condition selecting the rows that sort after `cursor` under a mixed
+    ascending/descending order, expanded as (a > ?) OR (a = ? AND b > ?) OR ...
+    SQLite sorts NULLs first when ascending and last when descending, so NULL
+    cursor values get their own comparisons. Values are appended to `params`.
+    """
+    terms = []
+    equal = []  # Conditions holding the columns before the current one at their cursor values
+    for (column, ascending), value in zip(sort_columns, cursor):
+        if value is None:
+            after, after_params = (f"{column} IS NOT NULL", []) if ascending else (None, [])
+            same, same_params = f"{column} IS NULL", []
+        else:
+            after = f"{column} > ?" if ascending else f"({column} < ? OR {column} IS NULL)"
+            after_params = [value]
+            same, same_params = f"{column} = ?", [value]
+        if after is not None:
+            terms.append(" AND ".join([condition for condition, _ in equal] + [after]))
+            params.extend(itertools.chain.from_iterable(values for _, values in equal))
+            params.extend(after_params)
+        equal.append((same, same_params))
+    return "(" + " OR ".join(f"({term})" for term in terms) + ")" if terms else "0"
+
+
+@anvil.server.callable
+@instrumented
+def search_page(table_name, query=None, after=None, page_size=100, offset=0,
+                columns=None, exclude_columns=None, order_by=None, wire_format=None, compress=False):
+    """
+    Fetches one page of the rows matching a serialized query, using keyset pagination.
+    Rows are ordered by `order_by` (a list of [column, ascending] pairs) and then
+    the table's key field(s), and `after` is the cursor returned with the previous
+    page (None for the first page). `offset` skips rows after the cursor, for
+    slicing into a result without fetching it all.
+    `columns` / `exclude_columns` project the rows (see select_columns).
+    Returns {'rows': [...], 'next': cursor, or None if this is the last page,
+    'lazy': columns left out of the rows}, with 'rows' encoded as selected by
+    `wire_format` and `compress` (see pack_rows).
+    """
+    conn = get_connection()
+
+    try:
+        cur = conn.cursor()
+        table_columns = get_table_columns(cur, table_name, query_fields(query))
+        sort_columns = get_sort_columns(cur, table_name, order_by)
+        select_list, omitted = select_columns(cur, table_name, columns, exclude_columns)
+
+        params = []
+        where_clause = compile_query(query, table_columns, params, table_name) if query else "1"
+        if after is not None and not order_by and None not in after:
+            # Plain key order: a row-value comparison lets SQLite seek on the key index.
+            # It is NULL if any cursor value is, so empty key fields take the NULL-aware path.
+            key_columns = [column for column, _ in sort_columns]
+            where_clause += f" AND ({', '.join(key_columns)}) > ({', '.join('?' for _ in key_columns)})"
+            params.extend(after)
+        elif after is not None:
+            where_clause += " AND " + keyset_after_sql(sort_columns, after, params)
+
+        # The sort values are selected under aliases, so the cursor can be built even
+        # if the sort columns are not part of the projection.
+        # Fetch one extra row to find out whether another page follows.
+        sort_select = ", ".join(f"{column} AS _page_sort_{i}" for i, (column, _) in enumerate(sort_columns))
+        order_clause = ", ".join(f"{column}{'' if ascending else ' DESC'}" for column, ascending in sort_columns)
+        sql = (f"SELECT {sort_select}, {select_list} FROM {table_name} WHERE {where_clause} "
+               f"ORDER BY {order_clause} LIMIT ? OFFSET ?")
+        params.extend([page_size + 1, offset])
+
+        rows = fetch_rows(cur, sql, params)
+
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last_row = rows[-1]
+            next_cursor = [last_row[f'_page_sort_{i}'] for i in range(len(sort_columns))]
+
+        schema = get_table_schema(cur, table_name)
+        page = []
+        for row in rows:
+            row_data = deserialize_row(row, schema)
+            for i in range(len(sort_columns)):
+                del row_data[f'_page_sort_{i}']
+            page.append(row_data)
+        # Include the media base URL so clients can resolve media columns without another call
+        return {'rows': pack_rows(page, wire_format, compress), 'next': next_cursor, 'lazy': omitted,
+                'base_url': get_base_url()}
+
+    except Exception as e:
+        logger.error("Error while searching rows: %s", e)
+        raise
+    finally:
+        release_connection(conn)
+
+
+@anvil.server.callable
+@instrumented
+def count_rows(table_name, query=None):
+    """Counts the rows of the given table that match a serialized query."""
+    conn = get_connection()
+
+    try:
+        cur = conn.cursor()
+        columns = get_table_columns(cur, table_name, query_fields(query))
+
+        params = []
+        where_clause = compile_query(query, columns, params, table_name) if query else "1"
+        sql = f"SELECT COUNT(*) FROM {table_name} WHERE {where_clause}"
+
+        return fetch_rows(cur, sql, params)[0][0]
+
+    except Exception as e:
+        logger.error("Error while counting rows: %s", e)
+        raise
+    finally:
+        release_connection(conn)
+
+
+@anvil.server.callable
+@instrumented
+def row_exists(table_name, query=None):
+    """Returns whether any row of the given table matches a serialized query, stopping at the first match."""
+    conn = get_connection()
+
+    try:
+        cur = conn.cursor()
+        columns = get_table_columns(cur, table_name, query_fields(query))
+
+        params = []
+        where_clause = compile_query(query, columns, params, table_name) if query else "1"
+        sql = f"SELECT 1 FROM {table_name} WHERE {where_clause} LIMIT 1"
+
+        return bool(fetch_rows(cur, sql, params))
+
+    except Exception as e:
+        logger.error("Error while checking for rows: %s", e)
+        raise
+    finally:
+        release_connection(conn)
+
+
+# Aggregate functions accepted by aggregate_rows, mapped to their SQL form
+AGGREGATE_FUNCTIONS = {'count': 'COUNT', 'sum': 'SUM', 'min': 'MIN', 'max': 'MAX', 'avg': 'AVG'}
+
+
+@anvil.server.callable
+@instrumented
+def aggregate_rows(table_name, aggregates, query=None, group_by=None):
+    """
+    Computes aggregates over the rows matching a serialized query.
+    `aggregates` maps result names to [function, column] pairs, where function is
+    one of AGGREGATE_FUNCTIONS and column may be None for count (counting rows).
+    Without `group_by`, returns a dict of result name -> value. With `group_by`
+    (a column name or list of names), returns one dict per group holding the
+    group column(s) and the results, ordered by the group column(s).
+    """
+    conn = get_connection()
+
+    try:
+        cur = conn.cursor()
+        group_columns = [group_by] if isinstance(group_by, str) else list(group_by or ())
+        aggregate_columns = {column for _, column in aggregates.values() if column is not None}
+        columns = get_table_columns(cur, table_name,
+                                    query_fields(query) | aggregate_columns | set(group_columns))
+
+        names = list(aggregates)
+        expressions = []
+        for name in names:
+            function, column = aggregates[name]
+            if function not in AGGREGATE_FUNCTIONS:
+                raise ValueError(f"Unsupported aggregate function: {function}")
+            if column is None:
+                if function != 'count':
+                    raise ValueError(f"Aggregate '{function}' needs a column")
+                expressions.append("COUNT(*)")
+            elif column not in columns:
+                raise ValueError(f"Unknown column: {column}")
+            else:
+                expressions.append(f"{AGGREGATE_FUNCTIONS[function]}({column})")
+        for column in group_columns:
+            if column not in columns:
+                raise ValueError(f"Unknown column: {column}")
+
+        params = []
+        where_clause = compile_query(query, columns, params, table_name) if query else "1"
+        sql = f"SELECT {', '.join(group_columns + expressions)} FROM {table_name} WHERE {where_clause}"
+        if group_columns:
+            sql += f" GROUP BY {', '.join(group_columns)} ORDER BY {', '.join(group_columns)}"
+
+        rows = fetch_rows(cur, sql, params)
+        if not group_columns:
+            return dict(zip(names, rows[0]))
+
+        schema = get_table_schema(cur, table_name)
+        groups = []
+        for row in rows:
+            group = deserialize_row(zip(group_columns, row), schema)  # Decodes JSON group values
+            group.update(zip(names, row[len(group_columns):]))
+            groups.append(group)
+        record_rows_returned(len(groups))
+        return groups
+
+    except Exception as e:
+        logger.error("Error while aggregating rows: %s", e)
+        raise
+    finally:
+        release_connection(conn)
 
 
 import os
@@ -80,198 +1226,449 @@ import anvil.server
 MEDIA_DIR = "media_files"
 os.makedirs(MEDIA_DIR, exist_ok=True)
 
+MEDIA_CHUNK_SIZE = 1024 * 1024  # Bytes written per chunk when storing media
+MEDIA_WORKERS = 8               # Media files written at the same time
+MEDIA_DOWNLOAD_TIMEOUT = 60     # Seconds a media download may stall (per connect or read) before it fails
+
+# Shared pool for writing media files, so uploads with many files are stored concurrently
+_media_executor = ThreadPoolExecutor(max_workers=MEDIA_WORKERS)
+
+def iter_media_chunks(media, download=True):
+    """
+    Yields the content of a media object in chunks. Media with a download URL is
+    streamed from it; other media (e.g. uploaded over the Uplink), or any media
+    with `download` False, is sliced from get_bytes().
+    """
+    try:
+        url = media.get_url() if download else None
+    except Exception:
+        url = None
+
+    if url and url.startswith(("http://", "https://")):
+        with urllib.request.urlopen(url, timeout=MEDIA_DOWNLOAD_TIMEOUT) as response:
+            for chunk in iter(lambda: response.read(MEDIA_CHUNK_SIZE), b""):
+                yield chunk
+    else:
+        content = memoryview(media.get_bytes())
+        for start in range(0, len(content), MEDIA_CHUNK_SIZE):
+            yield content[start:start + MEDIA_CHUNK_SIZE]
+
+def media_file_extension(media):
+    """Returns the file extension for a media object, from its name or content type."""
+    extension = os.path.splitext(media.name or "")[1]
+    if not extension and media.content_type:
+        extension = mimetypes.guess_extension(media.content_type) or ""
+    return extension if extension[1:].isalnum() else ""
+
+def write_media_file(media, path, download=True):
+    """Writes the content of a media object to a file, returning its SHA-256 hash object."""
+    digest = hashlib.sha256()
+    with open(path, "wb") as f:
+        for chunk in iter_media_chunks(media, download):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest
+
+def save_media(media):
+    """
+    Saves a media object under MEDIA_DIR, named by the SHA-256 of its content so
+    identical files are stored once, and returns the file path. The content is
+    streamed to a temporary file in chunks and renamed once its hash is known.
+    """
+    temp_path = os.path.join(MEDIA_DIR, f".upload-{uuid.uuid4().hex}")
+    try:
+        try:
+            digest = write_media_file(media, temp_path)
+        except OSError as e:
+            # The URL may not be open to outside requests (e.g. data table media); get_bytes() goes through Anvil
+            logger.warning("Could not download media, reading it with get_bytes() instead: %s", e)
+            digest = write_media_file(media, temp_path, download=False)
+
+        file_path = os.path.join(MEDIA_DIR, digest.hexdigest() + media_file_extension(media))
+        if os.path.exists(file_path):
+            os.remove(temp_path)  # Same content is already stored
+        else:
+            os.replace(temp_path, file_path)
+        return file_path
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def store_value(value):
+    """
+    Converts a value into the form stored in the database: media files are
+    saved under MEDIA_DIR and replaced by their path, complex types are serialized.
+    """
+    if isinstance(value, anvil.Media):
+        # Save media file and store file path in the database
+        return save_media(value)
+    elif isinstance(value, (dict, list)):
+        # Serialize complex types
+        return json.dumps(value)
+    return value
+
+def store_rows(rows):
+    """
+    Converts rows (lists of values) into their stored form like store_value,
+    writing all the media files they contain concurrently.
+    """
+    pending = [[_media_executor.submit(save_media, value) if isinstance(value, anvil.Media) else store_value(value)
+                for value in row] for row in rows]
+    return [[value.result() if isinstance(value, Future) else value for value in row] for row in pending]
+
+
 @anvil.server.callable
+@instrumented
 def add_row(table_name, **kwargs):
-    """Adds a new row to the given table, including handling media files."""
-    conn = get_connection()
-    columns = ', '.join(kwargs.keys())
-    placeholders = ', '.join('?' for _ in kwargs)
-
-    # Process values and handle media
-    processed_values = []
-    for key, value in kwargs.items():
-        if isinstance(value, anvil.Media):
-            # Save media file and store file path in the database
-            file_name = f"{table_name}_{key}_{value.name}"
-            file_path = os.path.join(MEDIA_DIR, file_name)
-            with open(file_path, "wb") as f:
-                f.write(value.get_bytes())
-            processed_values.append(file_path)
-        elif isinstance(value, (dict, list)):
-            # Serialize complex types
-            processed_values.append(json.dumps(value))
-        else:
-            processed_values.append(value)
+    """
+    Adds a new row to the given table, including handling media files.
+    Returns the stored row, read back in the same transaction.
+    """
+    # Process values and handle media before taking a connection, so a failed
+    # media write cannot hold on to it
+    processed_values = store_rows([list(kwargs.values())])[0]
 
-    query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
+    query = insert_sql(table_name, tuple(kwargs.keys()))
+    conn = get_connection()
     cur = conn.cursor()
 
     try:
-        print(f"Executing Query: {query} | Values: {processed_values}")  # Debug log
-        cur.execute(query, processed_values)
+        execute(cur, query, processed_values)
+        row = fetch_rows(cur, f"SELECT * FROM {table_name} WHERE rowid = ?", (cur.lastrowid,))[0]
+        schema = get_table_schema(cur, table_name)
+        record_changes(cur, table_name, 'upsert', [row_key(schema, row)])
+        bump_table_version(cur, table_name)
         conn.commit()
-        return cur.lastrowid
+        record_rows_returned(1)
+        return deserialize_row(row, schema)
     except Exception as e:
-        print(f"Error while adding row: {e}")
+        logger.error("Error while adding row: %s", e)
         raise
     finally:
-        conn.close()
-
+        release_connection(conn)
 
 
 @anvil.server.callable
-def update_row(table_name, primary_key, **new_data):
+@instrumented
+def add_rows(table_name, rows):
     """
-    Updates all columns of an existing row identified by its primary key(s),
-    serializing any complex data types like lists or dictionaries.
-    Supports both single-field and composite primary keys.
+    Adds many rows to the given table in a single transaction, handling media
+    files and complex types like add_row. Rows with the same set of columns are
+    inserted together with executemany.
+    Returns the key of each inserted row, in order: the key field value (or a
+    dict of values for composite keys), or the rowid if the row has no key value.
     """
     conn = get_connection()
-    id_fields = get_id_field(table_name)  # May return a single field or multiple fields
+    id_fields = get_id_field(table_name)
+    key_fields = [id_fields] if isinstance(id_fields, str) else id_fields
 
     try:
         cur = conn.cursor()
+        keys = [None] * len(rows)
+
+        # Group rows by their column set so each group is one executemany call
+        groups = {}
+        for index, row in enumerate(rows):
+            groups.setdefault(tuple(row.keys()), []).append(index)
+
+        for row_columns, indexes in groups.items():
+            query = insert_sql(table_name, row_columns)
+            has_keys = all(field in row_columns for field in key_fields)
+            values = store_rows([[rows[index][column] for column in row_columns] for index in indexes])
+
+            if has_keys:
+                execute_many(cur, query, values)
+                for index in indexes:
+                    row = rows[index]
+                    keys[index] = row[id_fields] if isinstance(id_fields, str) else {field: row[field] for field in key_fields}
+            else:
+                # Without key values, insert one by one so each rowid can be returned
+                for index, row_values in zip(indexes, values):
+                    execute(cur, query, row_values)
+                    keys[index] = cur.lastrowid
+
+        schema = get_table_schema(cur, table_name)
+        record_changes(cur, table_name, 'upsert',
+                       [[row.get(column) for column in schema.key_columns] for row in rows])
+        bump_table_version(cur, table_name)
+        conn.commit()
+        logger.debug("Added %d rows to %s.", len(rows), table_name)
+        record_rows_returned(len(keys))
+        return keys
+
+    except Exception as e:
+        conn.rollback()
+        logger.error("Error while adding rows: %s", e)
+        raise
+    finally:
+        release_connection(conn)
+
+
+def key_values(table_name, primary_key):
+    """
+    Returns the values that identify a row by its primary key(s), in key order.
+    For composite keys, primary_key may be a tuple/list in key order or a dict of key fields.
+    """
+    id_fields = get_id_field(table_name)  # May return a single field or multiple fields
 
-        # Get all columns dynamically
-        cur.execute(f"PRAGMA table_info({table_name})")
-        columns = [row[1] for row in cur.fetchall()]  # Column names are in the second field
+    # Handle single-field primary key
+    if isinstance(id_fields, str):
+        if isinstance(primary_key, (list, tuple)):  # Extract single value from list/tuple if needed
+            primary_key = primary_key[0]
+        return [primary_key]
 
-        # Prepare update query dynamically
-        updates = []
-        values = []
+    # Handle composite primary key
+    if isinstance(primary_key, dict):
+        primary_key = [primary_key.get(field) for field in id_fields]
+    if not isinstance(primary_key, (tuple, list)) or len(primary_key) != len(id_fields):
+        raise ValueError("For composite keys, primary_key must be a tuple with values for all key fields.")
+    return list(primary_key)
 
-        for column in columns:  # Iterate over all columns
-            if column in new_data:
-                value = new_data[column]
 
-                # Serialize complex types like lists or dictionaries
-                if isinstance(value, (dict, list)):
-                    value = json.dumps(value)
+def execute_update(cur, table_name, columns, primary_key, new_data):
+    """
+    Updates the given columns of a row identified by its primary key(s), without committing.
+    Complex data types like lists or dictionaries are serialized; unknown columns are ignored.
+    """
+    updated_columns = tuple(column for column in columns if column in new_data)
+    if not updated_columns:
+        return
 
-                updates.append(f"{column} = ?")
-                values.append(value)
+    old_key = key_values(table_name, primary_key)
+    values = [serialize_value(new_data[column]) for column in updated_columns] + old_key
+    query = update_sql(table_name, updated_columns)
 
-        # Handle primary keys
-        if isinstance(id_fields, str):  # Single-field primary key
-            where_clause = f"{id_fields} = ?"
-            if isinstance(primary_key, (list, tuple)):  # Extract single value from list/tuple if needed
-                primary_key = primary_key[0]
-            values.append(primary_key)
-        elif isinstance(id_fields, list):  # Composite primary key
-            where_clause = " AND ".join([f"{field} = ?" for field in id_fields])
+    execute(cur, query, values)
+    if cur.rowcount:
+        # A changed key field moves the row: its old key is gone from the feed's point of view
+        id_fields = get_id_field(table_name)
+        key_fields = [id_fields] if isinstance(id_fields, str) else list(id_fields)
+        new_key = [new_data.get(field, value) for field, value in zip(key_fields, old_key)]
+        if new_key != old_key:
+            record_changes(cur, table_name, 'delete', [old_key])
+        record_changes(cur, table_name, 'upsert', [new_key])
 
-            # Ensure `primary_key` is a tuple containing all necessary field values
-            if not isinstance(primary_key, (tuple, list)) or len(primary_key) != len(id_fields):
-                raise ValueError("For composite keys, primary_key must be a tuple with values for all key fields.")
 
-            values.extend(primary_key)
+def execute_delete(cur, table_name, row_id):
+    """Deletes a row identified by its primary key(s), without committing."""
+    values = key_values(table_name, row_id)
+    query = delete_sql(table_name)
 
-        # Build the query
-        query = f"UPDATE {table_name} SET {', '.join(updates)} WHERE {where_clause}"
+    execute(cur, query, values)
+    if cur.rowcount:
+        record_changes(cur, table_name, 'delete', [values])
 
-        # Debug log
-        print(f"Executing Query: {query} | Values: {values}")
 
-        # Execute the query
-        cur.execute(query, values)
+@anvil.server.callable
+@instrumented
+def update_row(table_name, primary_key, **new_data):
+    """
+    Updates all columns of an existing row identified by its primary key(s),
+    serializing any complex data types like lists or dictionaries.
+    Supports both single-field and composite primary keys.
+    """
+    conn = get_connection()
+
+    try:
+        cur = conn.cursor()
+        columns = get_table_columns(cur, table_name, new_data.keys())
+        execute_update(cur, table_name, columns, primary_key, new_data)
+        bump_table_version(cur, table_name)
         conn.commit()
-        print("Row updated successfully.")
 
     except Exception as e:
-        print(f"Primary Key Value: {primary_key}, Type: {type(primary_key)}")
-        print(f"Error while updating row: {e}")
+        logger.error("Error while updating row of %s (key type %s): %s", table_name, type(primary_key).__name__, e)
         raise
     finally:
-        conn.close()
-
-
+        release_connection(conn)
 
 
 @anvil.server.callable
+@instrumented
 def delete_row(table_name, row_id):
     """
     Deletes a row by its unique identifier (primary key).
     Supports both single-field and composite primary keys.
     """
     conn = get_connection()
-    id_fields = get_id_field(table_name)  # May return a single field or multiple fields
 
     try:
         cur = conn.cursor()
-
-        # Handle single-field primary key
-        if isinstance(id_fields, str):  # Single-field primary key
-            if isinstance(row_id, (list, tuple)):  # Extract single value from list/tuple if needed
-                row_id = row_id[0]
-            query = f"DELETE FROM {table_name} WHERE {id_fields} = ?"
-            print(f"Executing DELETE Query: {query}")
-            print(f"With Value: {row_id}")
-            cur.execute(query, (row_id,))
-
-        # Handle composite primary key
-        elif isinstance(id_fields, list):  # Composite primary key
-            if not isinstance(row_id, (tuple, list)) or len(row_id) != len(id_fields):
-                raise ValueError("For composite keys, row_id must be a tuple with values for all key fields.")
-
-            conditions = " AND ".join([f"{field} = ?" for field in id_fields])
-            query = f"DELETE FROM {table_name} WHERE {conditions}"
-            print(f"Executing DELETE Query: {query}")
-            print(f"With Values: {row_id}")
-            cur.execute(query, tuple(row_id))
-
+        execute_delete(cur, table_name, row_id)
+        bump_table_version(cur, table_name)
         conn.commit()
-        print("Row deleted successfully.")
 
     except Exception as e:
-        print(f"Row ID Value: {row_id}, Type: {type(row_id)}")
-        print(f"Error while deleting row: {e}")
+        logger.error("Error while deleting row of %s (key type %s): %s", table_name, type(row_id).__name__, e)
         raise
 
     finally:
-        conn.close()
+        release_connection(conn)
+
 
+@anvil.server.callable
+@instrumented
+def apply_batch(operations):
+    """
+    Applies a list of row updates and deletes in a single SQLite transaction.
+    Each operation is a dict:
+    - {'op': 'update', 'table': name, 'key': primary_key, 'values': {column: value}}
+    - {'op': 'delete', 'table': name, 'key': primary_key}
+    If any operation fails, the whole batch is rolled back.
+    """
+    conn = get_connection()
 
+    try:
+        cur = conn.cursor()
+        table_columns = {}  # Column names per table, read once for the whole batch
+
+        for operation in operations:
+            table_name = operation['table']
+            if operation['op'] == 'update':
+                if table_name not in table_columns:
+                    table_columns[table_name] = get_table_columns(cur, table_name, operation['values'].keys())
+                execute_update(cur, table_name, table_columns[table_name], operation['key'], operation['values'])
+            elif operation['op'] == 'delete':
+                execute_delete(cur, table_name, operation['key'])
+            else:
+                raise ValueError(f"Unsupported batch operation: {operation['op']}")
+
+        for table_name in {operation['table'] for operation in operations}:
+            bump_table_version(cur, table_name)
+        conn.commit()
+        logger.debug("Applied batch of %d operations.", len(operations))
+
+    except Exception as e:
+        conn.rollback()
+        logger.error("Error while applying batch, rolled back: %s", e)
+        raise
+    finally:
+        release_connection(conn)
 
 
 @anvil.server.callable
+@instrumented
 def get_row_by_id(table_name, row_id):
     """
     Fetches a row by its unique identifier (primary key).
     Supports both single-field and composite primary keys.
     """
     conn = get_connection()
-    id_fields = get_id_field(table_name)  # May return a single field or multiple fields
 
     try:
         cur = conn.cursor()
+        rows = fetch_rows(cur, select_by_key_sql(table_name), key_values(table_name, row_id))
 
-        # Handle single-field primary key
-        if len(id_fields) == 1:
-            query = f"SELECT * FROM {table_name} WHERE {id_fields[0]} = ?"
-            cur.execute(query, (row_id,))
-        # Handle composite primary key
-        else:
-            conditions = " AND ".join([f"{field} = ?" for field in id_fields])
-            query = f"SELECT * FROM {table_name} WHERE {conditions}"
+        record_rows_returned(1 if rows else 0)
+        # Deserialize JSON fields if applicable
+        return deserialize_row(rows[0], get_table_schema(cur, table_name)) if rows else None
 
-            # Ensure `row_id` is a tuple containing all necessary field values
-            if not isinstance(row_id, (tuple, list)) or len(row_id) != len(id_fields):
-                raise ValueError("For composite keys, row_id must be a tuple with values for all key fields.")
+    except Exception as e:
+        logger.error("Error while fetching row: %s", e)
+        raise
 
-            cur.execute(query, tuple(row_id))
+    finally:
+        release_connection(conn)
 
-        # Fetch the result
-        row = cur.fetchone()
+# Keys looked up per statement by get_rows_by_keys, keeping the bound values
+# under SQLite's limit of 999 variables on older builds
+GET_MANY_CHUNK_SIZE = 200
 
-        # Deserialize JSON fields if applicable
-        return {k: json.loads(v) if isinstance(v, str) and v.startswith('{') else v for k, v in dict(row).items()} if row else None
+def fetch_rows_by_keys(cur, table_name, keys, select_list="*", where_clause=None, where_params=()):
+    """
+    Looks up rows by key, joining the keys against the table as a numbered VALUES
+    list in chunks of GET_MANY_CHUNK_SIZE. Each key is a value, a list in key order
+    or a dict of key fields (see key_values). `select_list` names columns of the
+    table, unqualified, and `where_clause` (a compiled query) further filters the
+    rows. Returns the found rows, each with a '_wanted_pos' column holding the
+    position of its key in `keys`.
+    """
+    id_fields = get_id_field(table_name)
+    key_fields = [id_fields] if isinstance(id_fields, str) else list(id_fields)
+    if select_list == "*":
+        select_list = f"{table_name}.*"
+    else:
+        select_list = ", ".join(f"{table_name}.{column}" for column in select_list.split(", "))
+
+    # Joining on a numbered VALUES list keeps the input order and duplicates,
+    # and lets SQLite apply the columns' type affinity to the looked-up values.
+    # Its columns are named apart from the table's, so a compiled query stays unambiguous.
+    wanted_columns = ", ".join(["_wanted_pos"] + [f"_wanted_{i}" for i in range(len(key_fields))])
+    join_condition = " AND ".join(f"{table_name}.{field} = wanted._wanted_{i}" for i, field in enumerate(key_fields))
+    placeholders = "(" + ", ".join("?" for _ in range(len(key_fields) + 1)) + ")"
+
+    rows = []
+    for start in range(0, len(keys), GET_MANY_CHUNK_SIZE):
+        chunk = keys[start:start + GET_MANY_CHUNK_SIZE]
+        params = []
+        for position, key in enumerate(chunk, start):
+            params.append(position)
+            params.extend(key_values(table_name, key))
+        sql = (f"WITH wanted({wanted_columns}) AS (VALUES {', '.join(placeholders for _ in chunk)}) "
+               f"SELECT wanted._wanted_pos AS _wanted_pos, {select_list} "
+               f"FROM wanted JOIN {table_name} ON {join_condition}")
+        if where_clause:
+            sql += f" WHERE {where_clause}"
+        rows.extend(fetch_rows(cur, sql, params + list(where_params)))
+    return rows
+
+@anvil.server.callable
+@instrumented
+def get_rows_by_keys(table_name, keys, columns=None, exclude_columns=None, wire_format=None, compress=False):
+    """
+    Fetches many rows by primary key in one call. Each key is a value, a list in
+    key order or a dict of key fields (see key_values), looked up with
+    fetch_rows_by_keys.
+    Returns {'rows': [row or None for each key, in input order], 'lazy': columns
+    left out by the `columns` / `exclude_columns` projection}, with 'rows' encoded
+    as selected by `wire_format` and `compress` (see pack_rows).
+    """
+    conn = get_connection()
+
+    try:
+        cur = conn.cursor()
+        schema = get_table_schema(cur, table_name)
+        select_list, omitted = select_columns(cur, table_name, columns, exclude_columns)
+
+        rows = [None] * len(keys)
+        for row in fetch_rows_by_keys(cur, table_name, keys, select_list):
+            row_data = deserialize_row(row, schema)
+            rows[row_data.pop('_wanted_pos')] = row_data
+        return {'rows': pack_rows(rows, wire_format, compress), 'lazy': omitted}
+
+    except Exception as e:
+        logger.error("Error while fetching rows by key: %s", e)
+        raise
+    finally:
+        release_connection(conn)
+
+@anvil.server.callable
+@instrumented
+def get_row_columns(table_name, primary_key, columns):
+    """
+    Fetches only the given columns of a row, by primary key. Used by LiveRow to
+    load columns that were left out of a search result when they are first read.
+    Returns None if the row no longer exists.
+    """
+    conn = get_connection()
+
+    try:
+        cur = conn.cursor()
+        select_list, _ = select_columns(cur, table_name, columns)
+        rows = fetch_rows(cur, select_by_key_sql(table_name, select_list), key_values(table_name, primary_key))
+        record_rows_returned(1 if rows else 0)
+        if not rows:
+            return None
+        row_data = deserialize_row(rows[0], get_table_schema(cur, table_name))
+        return {column: row_data[column] for column in columns}
 
     except Exception as e:
-        print(f"Error while fetching row: {e}")
+        logger.error("Error while fetching columns: %s", e)
         raise
 
     finally:
-        conn.close()
+        release_connection(conn)
 
 @anvil.server.callable
 def get_base_url(port=8000):
@@ -289,18 +1686,28 @@ def get_base_url(port=8000):
     hostname = socket.gethostbyname(socket.gethostname())
     return f"http://{hostname}:{port}"
 
-# Main function to start both servers
+# Make sure the bookkeeping tables and the key, secondary and full-text indexes exist before
+# serving requests, then load the schema registry
+ensure_metadata_tables()
+ensure_indexes()
+ensure_full_text_indexes()
+refresh_schema_registry()
+
+# Main function to start both servers. Connecting to the Uplink only here keeps the
+# module importable without an Anvil app, e.g. by benchmark.py.
 if __name__ == "__main__":
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    # Connect to Anvil's Uplink
+    anvil.server.connect(UPLINK_KEY)
+
     # Start Flask in a separate thread
     flask_thread = threading.Thread(target=run_flask)
     flask_thread.daemon = True  # Stops Flask when the main thread exits
     flask_thread.start()
 
-    print("Flask server running on http://127.0.0.1:8000")
+    logger.info("Flask server running on http://127.0.0.1:8000")
 
     # Start the Anvil Uplink server
-    print("Anvil Uplink server is running...")
+    logger.info("Anvil Uplink server is running...")
     anvil.server.wait_forever()
-
-print("SQLite Uplink server is running...")
-anvil.server.wait_forever()
@@ -1,11 +1,67 @@
+import asyncio
+import atexit
+import base64
+import copy
+import functools
+import itertools
 import json
+import logging
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import anvil.server
+import anvil.tables
 from anvil.tables import query as q
 from anvil.tables import app_tables as original_app_tables
 
 # Flag to control replication to Anvil Data Tables
 REPLICATE_TO_ANVIL = True  # Set to True to enable replication
 
+# Replication to Anvil runs on a background thread so writes do not wait for the Anvil DB.
+# Set REPLICATE_ASYNC to False to replicate synchronously inside each write instead.
+REPLICATE_ASYNC = True
+REPLICATION_BATCH_SIZE = 100     # Maximum writes applied per batch
+REPLICATION_BATCH_DELAY = 0.5    # Seconds to wait for more writes to coalesce before applying a batch
+REPLICATION_FLUSH_TIMEOUT = 30   # Seconds to wait for pending replication at interpreter exit
+REPLICATION_RETRIES = 3          # Retries of a queued write that fails, before it is kept as failed
+REPLICATION_RETRY_DELAY = 1.0    # Seconds before the first retry, doubled for each further retry
+
+# Number of rows fetched per round trip when iterating over search results
+DEFAULT_PAGE_SIZE = 100
+
+# Maximum number of rows sent to the Uplink server per add_rows call
+ADD_ROWS_CHUNK_SIZE = 5000
+
+# Seconds between checks of a cached table's version counter on the Uplink server.
+# Writes made by other clients become visible to a cache within this interval.
+CACHE_VERSION_CHECK_INTERVAL = 2
+
+# Heavy columns (large JSON blobs, long text) left out of search results, per table.
+# LiveRow loads them by primary key the first time they are read, e.g.
+# LAZY_COLUMNS = {'candidates': ['resume_text', 'parsed_profile']}
+LAZY_COLUMNS = {}
+
+# Maximum number of Uplink calls made at the same time by the *_async methods and gather()
+ASYNC_WORKERS = 8
+
+# Result encoding requested from the Uplink server: 'columnar' sends column names once
+# per page instead of once per row; None asks for plain lists of row dicts
+WIRE_FORMAT = 'columnar'
+# Let the server zlib-compress large columnar results (see COMPRESS_MIN_BYTES on the server)
+COMPRESS_RESULTS = True
+
+# Uplink round trips slower than this are logged as warnings; None disables the log
+SLOW_CALL_MS = 500
+
+# Upper bounds of the round-trip time histogram buckets, in milliseconds
+ROUND_TRIP_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Debug logs name tables, keys and columns but never row values. Enable them with
+# logging.getLogger("wrapper").setLevel(logging.DEBUG).
+logger = logging.getLogger("wrapper")
+
 # Obtain the types of query condition objects
 _all_of_type = type(q.all_of())
 _any_of_type = type(q.any_of())
@@ -14,6 +70,89 @@ _less_than_type = type(q.less_than(0))
 _greater_than_type = type(q.greater_than(0))
 _less_than_or_equal_type = type(q.less_than_or_equal_to(0))
 _greater_than_or_equal_type = type(q.greater_than_or_equal_to(0))
+_page_size_type = type(q.page_size(1))
+_fetch_only_type = type(q.fetch_only())
+_order_by_type = type(anvil.tables.order_by(''))
+_full_text_match_type = type(q.full_text_match(''))
+_like_type = type(q.like(''))
+_ilike_type = type(q.ilike(''))
+
+# Map compound query types to the boolean operators understood by the Uplink server
+_compound_operators = {
+    _all_of_type: 'and',
+    _any_of_type: 'or',
+    _not_type: 'not',
+}
+
+# Map comparison query types to the comparison operators understood by the Uplink server
+_comparison_operators = {
+    _less_than_type: '<',
+    _less_than_or_equal_type: '<=',
+    _greater_than_type: '>',
+    _greater_than_or_equal_type: '>=',
+}
+
+# Map pattern query types to the text operators understood by the Uplink server
+_pattern_operators = {
+    _like_type: 'like',
+    _ilike_type: 'ilike',
+}
+
+# Round-trip times per Uplink function: [count per bucket..., total count, total ms]
+_round_trips = {}
+_round_trips_lock = threading.Lock()
+
+def _call(function_name, *args, **kwargs):
+    """Calls an Uplink server function, recording the round-trip time."""
+    started = time.perf_counter()
+    try:
+        return anvil.server.call(function_name, *args, **kwargs)
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with _round_trips_lock:
+            stats = _round_trips.get(function_name)
+            if stats is None:
+                stats = _round_trips[function_name] = [0] * (len(ROUND_TRIP_BUCKETS_MS) + 2)
+            for i, bound in enumerate(ROUND_TRIP_BUCKETS_MS):
+                if elapsed_ms <= bound:
+                    stats[i] += 1
+            stats[-2] += 1
+            stats[-1] += elapsed_ms
+        if SLOW_CALL_MS is not None and elapsed_ms >= SLOW_CALL_MS:
+            logger.warning("slow uplink call function=%s ms=%.1f", function_name, elapsed_ms)
+        else:
+            logger.debug("uplink call function=%s ms=%.2f", function_name, elapsed_ms)
+
+def get_metrics():
+    """
+    Returns the Uplink round-trip times seen by this client, per server function:
+    {'search_page': {'calls': n, 'total_ms': t, 'mean_ms': m, 'buckets': {bound_ms: calls at or under it}}}.
+    Server-side SQL and call metrics are served on the Uplink server's /metrics route.
+    """
+    with _round_trips_lock:
+        return {
+            function_name: {
+                'calls': stats[-2],
+                'total_ms': stats[-1],
+                'mean_ms': stats[-1] / stats[-2] if stats[-2] else 0,
+                'buckets': dict(zip(ROUND_TRIP_BUCKETS_MS, stats)),
+            }
+            for function_name, stats in _round_trips.items()
+        }
+
+def reset_metrics():
+    """Clears the recorded round-trip times."""
+    with _round_trips_lock:
+        _round_trips.clear()
+
+def _unpack_rows(packed):
+    """Decodes rows encoded by the Uplink server's pack_rows into a list of row dicts (or None entries)."""
+    if isinstance(packed, list):
+        return packed
+    if packed.get('encoding') == 'zlib':
+        packed = json.loads(zlib.decompress(base64.b64decode(packed['data'])))
+    columns = packed['columns']
+    return [None if values is None else dict(zip(columns, values)) for values in packed['values']]
 
 def get_id_field(table_name):
     """
@@ -32,55 +171,492 @@ def get_id_field(table_name):
     }
     return id_fields.get(table_name, 'id')  # Default to 'id' (single-field primary key)
 
+# Base URL of the media server, fetched from the Uplink server once per process
+_base_url = None
+
+def get_base_url():
+    """Returns the media server's base URL, fetching it from the Uplink server on first use."""
+    global _base_url
+    if _base_url is None:
+        _base_url = _call("get_base_url")
+    return _base_url
+
+def refresh_base_url():
+    """Drops the cached media base URL (e.g. after the server moved) and fetches it again."""
+    global _base_url
+    _base_url = None
+    return get_base_url()
+
+def _key_values(table_name, row_data):
+    """Returns the primary key value(s) of a row as a tuple, for use as a cache key."""
+    pk_fields = get_id_field(table_name)
+    fields = [pk_fields] if isinstance(pk_fields, str) else pk_fields
+    return tuple(row_data.get(field) for field in fields)
+
+class _ReplicationQueue:
+    """
+    Queue of writes to replicate to original_app_tables, applied in batches by a
+    background worker. Pending writes to the same row are coalesced: repeated
+    updates are merged, updates to a pending added row are folded into the add,
+    and a delete replaces any pending update. A write that fails is retried with
+    backoff, holding back the writes after it so they are applied in order, and
+    kept in `failed` if it still fails.
+    """
+
+    def __init__(self):
+        self._pending = OrderedDict()  # coalescing key -> operation dict
+        self._condition = threading.Condition()
+        self._counter = itertools.count()
+        self._in_flight = []           # Operations taken by the worker and not applied yet
+        self._worker = None
+        self.applied = 0               # Number of operations applied
+        self.failed = []               # Operations that still raised after their retries, with the error
+
+    def enqueue_update(self, table_name, primary_key, changes):
+        with self._condition:
+            row_key = (table_name, json.dumps(primary_key, sort_keys=True, default=repr))
+            operation = self._pending.get(row_key)
+            if operation and operation['kind'] in ('add', 'update'):
+                operation['values'].update(changes)
+            elif operation is None:
+                self._put(row_key, 'update', table_name, primary_key, dict(changes))
+            # Updates to a row with a pending delete are dropped, the row is gone
+
+    def enqueue_delete(self, table_name, primary_key):
+        with self._condition:
+            row_key = (table_name, json.dumps(primary_key, sort_keys=True, default=repr))
+            operation = self._pending.pop(row_key, None)
+            if operation and operation['kind'] == 'add':
+                return  # The row was never replicated, so there is nothing to delete
+            self._put(row_key, 'delete', table_name, primary_key, None)
+
+    def enqueue_add(self, table_name, values):
+        with self._condition:
+            pk_fields = get_id_field(table_name)
+            fields = [pk_fields] if isinstance(pk_fields, str) else pk_fields
+            if all(field in values for field in fields):
+                primary_key = values[pk_fields] if isinstance(pk_fields, str) else {field: values[field] for field in fields}
+                row_key = (table_name, json.dumps(primary_key, sort_keys=True, default=repr))
+                if row_key in self._pending:
+                    # Keep an earlier pending delete of the same key ahead of this add
+                    self._pending[('op', next(self._counter))] = self._pending.pop(row_key)
+            else:
+                row_key = ('op', next(self._counter))
+            self._put(row_key, 'add', table_name, None, dict(values))
+
+    def enqueue(self, kind, table_name, primary_key=None, values=None):
+        """Queues an 'add', 'update' or 'delete' write."""
+        if kind == 'add':
+            self.enqueue_add(table_name, values)
+        elif kind == 'update':
+            self.enqueue_update(table_name, primary_key, values)
+        else:
+            self.enqueue_delete(table_name, primary_key)
+
+    def _put(self, row_key, kind, table_name, primary_key, values):
+        self._pending[row_key] = {'kind': kind, 'table': table_name, 'key': primary_key,
+                                  'values': values, 'queued_at': time.monotonic()}
+        self._ensure_worker()
+        self._condition.notify_all()
+
+    def depth(self):
+        """Returns the number of writes waiting to be replicated, including the batch being applied."""
+        with self._condition:
+            return len(self._pending) + len(self._in_flight)
+
+    def lag(self):
+        """Returns how many seconds the oldest write still waiting to be replicated has been queued."""
+        with self._condition:
+            queued = [operation['queued_at'] for operation in self._in_flight]
+            queued += [operation['queued_at'] for operation in self._pending.values()]
+            return time.monotonic() - min(queued) if queued else 0.0
+
+    def flush(self, timeout=None):
+        """Waits until every queued write is replicated. Returns False if the timeout expired first."""
+        with self._condition:
+            self._condition.notify_all()  # Wake the worker so it skips the coalescing delay
+            return self._condition.wait_for(lambda: not self._pending and not self._in_flight, timeout)
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="anvil-replication", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                # Give further writes to the same rows a chance to coalesce
+                self._condition.wait(REPLICATION_BATCH_DELAY)
+                while self._pending and len(self._in_flight) < REPLICATION_BATCH_SIZE:
+                    self._in_flight.append(self._pending.popitem(last=False)[1])
+                batch = list(self._in_flight)
+
+            self.apply_batch(batch)
+
+            with self._condition:
+                self._in_flight = []
+                self._condition.notify_all()
+
+    def apply_batch(self, batch):
+        """
+        Applies replicated writes to original_app_tables in order, retrying a write
+        that raises up to REPLICATION_RETRIES times with exponential backoff.
+        """
+        replicated_tables = set(dir(original_app_tables))
+        for operation in batch:
+            if operation['table'] not in replicated_tables:
+                continue
+            for attempt in range(REPLICATION_RETRIES + 1):
+                try:
+                    self._apply(operation)
+                    self.applied += 1
+                    break
+                except Exception as e:
+                    if attempt == REPLICATION_RETRIES:
+                        logger.error("Error replicating %s to %s, giving up: %s", operation['kind'], operation['table'], e)
+                        with self._condition:
+                            self.failed.append(dict(operation, error=repr(e)))
+                    else:
+                        delay = REPLICATION_RETRY_DELAY * 2 ** attempt
+                        logger.warning("Error replicating %s to %s, retrying in %.1fs: %s",
+                                       operation['kind'], operation['table'], delay, e)
+                        time.sleep(delay)
+
+    def apply_now(self, operation):
+        """Applies one replicated write right away, raising if it fails."""
+        if operation['table'] in dir(original_app_tables):
+            self._apply(operation)
+            self.applied += 1
+
+    def take_failed(self):
+        """Removes and returns the operations kept as failed."""
+        with self._condition:
+            failed, self.failed = self.failed, []
+            return failed
+
+    def _apply(self, operation):
+        table = getattr(original_app_tables, operation['table'])
+        if operation['kind'] == 'add':
+            table.add_row(**operation['values'])
+            return
+
+        pk_fields = get_id_field(operation['table'])
+        primary_key = operation['key']
+        row = table.get(**({pk_fields: primary_key} if isinstance(pk_fields, str) else primary_key))
+        if row:
+            if operation['kind'] == 'update':
+                row.update(**operation['values'])
+            else:
+                row.delete()
+
+_replication_queue = _ReplicationQueue()
+
+def _replicate(kind, table_name, primary_key=None, values=None):
+    """Replicates a write to original_app_tables, queued or immediately depending on REPLICATE_ASYNC."""
+    if not REPLICATE_TO_ANVIL:
+        return
+    if REPLICATE_ASYNC:
+        _replication_queue.enqueue(kind, table_name, primary_key, values)
+    else:
+        # Raises to the caller, so a write that did not reach Anvil is not missed
+        _replication_queue.apply_now({'kind': kind, 'table': table_name, 'key': primary_key, 'values': values})
+
+def replication_queue_depth():
+    """Returns the number of writes waiting to be replicated to Anvil."""
+    return _replication_queue.depth()
+
+def replication_lag():
+    """Returns the age in seconds of the oldest write waiting to be replicated to Anvil."""
+    return _replication_queue.lag()
+
+def replication_failures():
+    """Returns the number of writes that could not be replicated to Anvil, even after retrying."""
+    return len(_replication_queue.failed)
+
+def failed_replications():
+    """
+    Returns the writes that could not be replicated to Anvil, as dicts with their
+    'kind', 'table', 'key', 'values' and 'error'.
+    """
+    return [dict(operation) for operation in _replication_queue.failed]
+
+def retry_failed_replications():
+    """Queues the writes that could not be replicated to Anvil again. Returns how many were queued."""
+    failed = _replication_queue.take_failed()
+    for operation in failed:
+        _replication_queue.enqueue(operation['kind'], operation['table'], operation['key'], operation['values'])
+    return len(failed)
+
+def flush_replication(timeout=None):
+    """Blocks until every queued write is replicated to Anvil. Call this before shutting down."""
+    return _replication_queue.flush(timeout)
+
+atexit.register(flush_replication, REPLICATION_FLUSH_TIMEOUT)
+
+def _normalize_query(query):
+    """Returns a canonical string form of a serialized query, for use as a cache key."""
+    return json.dumps(query, sort_keys=True, default=repr)
+
+class RowCache:
+    """
+    LRU cache with a TTL for the rows and search results of one table, keyed by
+    primary key and by normalized query. The table's version counter on the
+    Uplink server is checked periodically so writes from other clients clear it.
+    """
+
+    def __init__(self, table_name, max_entries=1000, ttl=30):
+        self._table_name = table_name
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()  # cache key -> (expiry time, value)
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = None
+
+    def get(self, key):
+        """Returns a copy of the cached value for key, or None if it is missing or expired."""
+        self._check_version()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        # Callers may mutate the value (LiveRow deserializes in place), so hand out a copy
+        return copy.deepcopy(value)
+
+    def put(self, key, value):
+        """Stores a copy of value under key, evicting the least recently used entries if full."""
+        self._check_version()
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def put_row(self, row_data):
+        """Caches a row under its primary key."""
+        self.put(('row', _key_values(self._table_name, row_data)), row_data)
+
+    def invalidate_row(self, key_values):
+        """Drops a row and every cached query result, since any of them may include it."""
+        with self._lock:
+            self._entries.pop(('row', tuple(key_values)), None)
+            self._drop_queries()
+
+    def invalidate_queries(self):
+        """Drops every cached query result, e.g. after a row was added."""
+        with self._lock:
+            self._drop_queries()
+
+    def clear(self):
+        """Drops every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def _drop_queries(self):
+        for key in [key for key in self._entries if key[0] != 'row']:
+            del self._entries[key]
+
+    def _check_version(self):
+        """Clears the cache if the table was written to since the last version check."""
+        now = time.monotonic()
+        if self._version_checked_at is not None and now - self._version_checked_at < CACHE_VERSION_CHECK_INTERVAL:
+            return
+        version = _call('get_table_version', self._table_name)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._version_checked_at = now
+
+# Row caches of the tables that have caching enabled, keyed by table name
+_row_caches = {}
+
+def enable_cache(table_name, max_entries=1000, ttl=30):
+    """Enables the client-side row cache for a table."""
+    _row_caches[table_name] = RowCache(table_name, max_entries=max_entries, ttl=ttl)
+
+def disable_cache(table_name):
+    """Disables and drops the client-side row cache for a table."""
+    _row_caches.pop(table_name, None)
+
+def _cached_call(table_name, cache_key, function_name, *args):
+    """Calls an Uplink server function, going through the table's row cache if enabled."""
+    cache = _row_caches.get(table_name)
+    result = cache.get(cache_key) if cache else None
+    if result is None:
+        result = _call(function_name, table_name, *args)
+        if cache:
+            cache.put(cache_key, result)
+    return result
+
+# Marks a column a row did not have before a batched change
+_UNSET = object()
+
+class _WriteBatch(threading.local):
+    """
+    Context manager that collects LiveRow writes and sends them to the Uplink
+    server in a single apply_batch call on exit, where they are applied in one
+    SQLite transaction. Nested blocks are flushed when the outermost one exits.
+    If the block raises, or the Uplink server fails to apply the batch, the queued
+    writes are discarded and the rows get their previous values back.
+    Only row updates and deletes are collected: add_row and add_rows are sent
+    right away and are not part of the batch (or transaction).
+    """
+
+    def __init__(self, kinds):
+        self._kinds = kinds   # Which writes this batch collects: 'update' and/or 'delete'
+        self._depth = 0
+        self._operations = []  # Queued operations, in order
+        self._updates = {}     # (table, key) -> index of its pending update in _operations
+        self._originals = {}   # id(row) -> (row, {column: (value before the batch, was lazy)})
+
+    def collects(self, kind):
+        return self._depth > 0 and kind in self._kinds
+
+    def queue_update(self, row, primary_key, name, value):
+        """
+        Queue a column change, merging it with earlier changes to the same row.
+        Called before the row's value changes, so the previous value can be restored.
+        """
+        _, originals = self._originals.setdefault(id(row), (row, {}))
+        if name not in originals:
+            originals[name] = (row._row_data.get(name, _UNSET), name in row._lazy_columns)
+        update_key = (row._table_name, json.dumps(primary_key, sort_keys=True, default=repr))
+        if update_key in self._updates:
+            self._operations[self._updates[update_key]][2][name] = value
+        else:
+            self._updates[update_key] = len(self._operations)
+            self._operations.append(('update', row, {name: value}, primary_key))
+
+    def queue_delete(self, row, primary_key):
+        """Queue a row delete."""
+        self._operations.append(('delete', row, None, primary_key))
+
+    def flush(self):
+        """Send the queued writes to the Uplink server in one call."""
+        operations, originals = self._operations, self._originals
+        self._operations, self._updates, self._originals = [], {}, {}
+        if not operations:
+            return
+        logger.debug("Sending batch of %d operations", len(operations))
+        try:
+            _call('apply_batch', [
+                {'op': kind, 'table': row._table_name, 'key': primary_key, 'values': values}
+                for kind, row, values, primary_key in operations
+            ])
+        except Exception:
+            self._restore(originals)
+            raise
+        for kind, row, values, primary_key in operations:
+            if kind == 'update':
+                row._after_update(primary_key, values)
+            else:
+                row._after_delete(primary_key)
+
+    def __enter__(self):
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth -= 1
+        if self._depth == 0:
+            if exc_type is None:
+                self.flush()
+            else:
+                originals = self._originals
+                self._operations, self._updates, self._originals = [], {}, {}
+                self._restore(originals)
+
+    @staticmethod
+    def _restore(originals):
+        """Puts back the values rows had before their discarded changes."""
+        for row, columns in originals.values():
+            for name, (value, was_lazy) in columns.items():
+                if value is _UNSET:
+                    row._row_data.pop(name, None)
+                else:
+                    row._row_data[name] = value
+                if was_lazy:
+                    row._lazy_columns.add(name)
+
+# Mirror anvil.tables.batch_update / batch_delete; transaction collects both.
+# Rows added inside these blocks are stored immediately, not with the batch.
+batch_update = _WriteBatch(('update',))
+batch_delete = _WriteBatch(('delete',))
+transaction = _WriteBatch(('update', 'delete'))
+
+def _active_batch(kind):
+    """Returns the active batch collecting writes of the given kind, if any."""
+    for batch in (transaction, batch_update, batch_delete):
+        if batch.collects(kind):
+            return batch
+    return None
+
+# Shared by the *_async methods and gather(), so concurrent calls stay bounded by ASYNC_WORKERS
+_async_executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix='wrapper-async')
+
+async def _run_async(function, *args, **kwargs):
+    """Runs a blocking wrapper call on the shared thread pool and awaits its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_async_executor, functools.partial(function, *args, **kwargs))
+
+def gather(*calls, timeout=None):
+    """
+    Runs independent blocking calls at the same time on the shared thread pool
+    and returns their results in order, e.g.
+        projects, candidates = gather(lambda: list(app_tables.projects.search(owner=me)),
+                                      lambda: app_tables.candidates.count())
+    The first exception raised by a call is re-raised once every call has finished.
+    Write batches (batch_update etc.) are per thread and do not cover these calls.
+    Calls must not use gather() themselves, as they could wait on a full pool.
+    """
+    futures = [_async_executor.submit(call) for call in calls]
+    for future in futures:
+        future.exception(timeout=timeout)  # Wait for every call before raising
+    return [future.result() for future in futures]
+
 class LiveRow:
     """Represents a live row object that synchronizes with the database."""
 
-    def __init__(self, table_name, row_data):
+    def __init__(self, table_name, row_data, lazy_columns=()):
         self._table_name = table_name
-        self._row_data = self._deserialize(row_data)
+        self._row_data = row_data  # JSON columns are already decoded by the Uplink server
+        # Columns left out of the search result, loaded by primary key when first read
+        self._lazy_columns = set(lazy_columns) - set(row_data)
 
     def __getattr__(self, name):
         """Allow attribute-style access."""
-        if name in self._row_data:
+        if name in self.__dict__.get('_lazy_columns', ()):
+            self._load_columns([name])
+        if name in self.__dict__.get('_row_data', ()):
             return self._row_data[name]
         raise AttributeError(f"{name} not found in row")
 
     def __setattr__(self, name, value):
         """Update value and sync to the database."""
-        if name in ['_table_name', '_row_data']:
+        if name in ['_table_name', '_row_data', '_lazy_columns']:
             super().__setattr__(name, value)
         else:
-            old_value = self._row_data.get(name, None)  # Get old value
-            self._row_data[name] = value
+            primary_key = self._primary_key()  # Taken before the change, in case a key field is updated
 
-            # Get primary key(s)
-            pk_fields = get_id_field(self._table_name)
+            batch = _active_batch('update')
+            if batch:
+                # The row shows the new value inside the block; the batch restores it if discarded
+                logger.debug("Queueing update of %s: key %s, column %s", self._table_name, primary_key, name)
+                batch.queue_update(self, primary_key, name, value)
+                self._set_value(name, value)
+                return
 
-            # Handle single-field primary key
-            if isinstance(pk_fields, str):  # Single primary key field
-                primary_key = self._row_data[pk_fields]
-                print(f"Updating {self._table_name}: {pk_fields}={primary_key}, {name} from {old_value} to {value}")
-                anvil.server.call('update_row', self._table_name, primary_key, **{name: value})
-
-                # Also update original_app_tables if replication is enabled
-                if REPLICATE_TO_ANVIL and self._table_name in dir(original_app_tables):
-                    table = getattr(original_app_tables, self._table_name)
-                    row = table.get(**{pk_fields: primary_key})
-                    if row:
-                        row[name] = value
-
-            # Handle composite primary key
-            elif isinstance(pk_fields, list):  # Composite primary key
-                primary_key = {field: self._row_data[field] for field in pk_fields}
-                print(f"Updating {self._table_name}: Composite key {primary_key}, {name} from {old_value} to {value}")
-                anvil.server.call('update_row', self._table_name, primary_key, **{name: value})
-
-                # Also update original_app_tables if replication is enabled
-                if REPLICATE_TO_ANVIL and self._table_name in dir(original_app_tables):
-                    table = getattr(original_app_tables, self._table_name)
-                    row = table.get(**primary_key)
-                    if row:
-                        row[name] = value
+            logger.debug("Updating %s: key %s, column %s", self._table_name, primary_key, name)
+            _call('update_row', self._table_name, primary_key, **{name: value})
+            self._set_value(name, value)  # Only once stored, so a failed update leaves the row as it was
+            self._after_update(primary_key, {name: value})
 
     def __setitem__(self, key, value):
         """Allow setting values via subscriptable access (row['key'] = value)."""
@@ -88,62 +664,120 @@ class LiveRow:
 
     def delete(self):
         """Deletes this row from the database."""
+        primary_key = self._primary_key()
+
+        batch = _active_batch('delete')
+        if batch:
+            logger.debug("Queueing delete of row from %s where key %s", self._table_name, primary_key)
+            batch.queue_delete(self, primary_key)
+            return
+
+        logger.debug("Deleting row from %s where key %s", self._table_name, primary_key)
+        _call('delete_row', self._table_name, primary_key)
+        self._after_delete(primary_key)
+
+    async def delete_async(self):
+        """Deletes this row without blocking the event loop."""
+        await _run_async(self.delete)
+
+    async def update_async(self, **values):
+        """Sets several columns of this row in one Uplink call, without blocking the event loop."""
+        def update():
+            with batch_update:
+                for name, value in values.items():
+                    setattr(self, name, value)
+        await _run_async(update)
+
+    def batch_update(self):
+        """
+        Returns a context manager that collects changes to this row (and any other
+        rows changed in the block) and sends them in a single Uplink call on exit.
+        """
+        return batch_update
+
+    def _primary_key(self):
+        """Returns the primary key of this row: a single value, or a dict of values for composite keys."""
         pk_fields = get_id_field(self._table_name)
+        if isinstance(pk_fields, str):  # Single primary key field
+            return self._row_data[pk_fields]
+        return {field: self._row_data[field] for field in pk_fields}  # Composite primary key
+
+    def _set_value(self, name, value):
+        """Sets a column value locally."""
+        self._row_data[name] = value
+        self._lazy_columns.discard(name)  # The new value is known, no need to load it
+
+    def _after_update(self, primary_key, changes):
+        """Invalidate the row cache and replicate changes once they are stored."""
+        self._invalidate_cache(primary_key)
+        _replicate('update', self._table_name, primary_key, changes)
+
+    def _after_delete(self, primary_key):
+        """Invalidate the row cache and replicate the delete once it is stored."""
+        self._invalidate_cache(primary_key)
+        _replicate('delete', self._table_name, primary_key)
+
+    def _load_columns(self, columns):
+        """Loads lazy columns of this row from the Uplink server by primary key."""
+        logger.debug("Loading columns %s of %s row %s", columns, self._table_name, self._primary_key())
+        values = _call('get_row_columns', self._table_name, self._primary_key(), sorted(columns))
+        if values is None:
+            raise ValueError(f"Row {self._primary_key()} of {self._table_name} no longer exists")
+        self._row_data.update(values)
+        self._lazy_columns.difference_update(columns)
 
-        # Handle single-field primary key
-        if isinstance(pk_fields, str):
-            primary_key = self._row_data[pk_fields]
-            print(f"Deleting row from {self._table_name} where {pk_fields}={primary_key}")
-            anvil.server.call('delete_row', self._table_name, primary_key)
-
-            # Also delete from original_app_tables if replication is enabled
-            if REPLICATE_TO_ANVIL and self._table_name in dir(original_app_tables):
-                table = getattr(original_app_tables, self._table_name)
-                row = table.get(**{pk_fields: primary_key})
-                if row:
-                    row.delete()
-
-        # Handle composite primary key
-        elif isinstance(pk_fields, list):
-            primary_key = {field: self._row_data[field] for field in pk_fields}
-            print(f"Deleting row from {self._table_name} where composite key {primary_key}")
-            anvil.server.call('delete_row', self._table_name, primary_key)
-
-            # Also delete from original_app_tables if replication is enabled
-            if REPLICATE_TO_ANVIL and self._table_name in dir(original_app_tables):
-                table = getattr(original_app_tables, self._table_name)
-                row = table.get(**primary_key)
-                if row:
-                    row.delete()
+    def _load_lazy_columns(self):
+        """Loads every lazy column not read yet, in one call."""
+        if self._lazy_columns:
+            self._load_columns(list(self._lazy_columns))
+
+    def _invalidate_cache(self, primary_key):
+        """
+        Drops this row and the table's cached search results from the row cache, if
+        enabled. The row is dropped under `primary_key`, the key it had before the
+        write, and under its current key, in case the write changed a key field.
+        """
+        cache = _row_caches.get(self._table_name)
+        if cache:
+            old_key = _key_values(self._table_name, primary_key) if isinstance(primary_key, dict) else (primary_key,)
+            cache.invalidate_row(old_key)
+            new_key = _key_values(self._table_name, self._row_data)
+            if new_key != old_key:
+                cache.invalidate_row(new_key)
 
     def __getitem__(self, key):
         """Allow dictionary-style access to row data."""
+        if key in self._lazy_columns:
+            self._load_columns([key])
         if key in self._row_data:
             value = self._row_data[key]
 
             # If it's a file path, build the URL string directly
             if isinstance(value, str) and value.startswith("media_files/"):
-                base_url = anvil.server.call("get_base_url")  # Call the Uplink server function
+                base_url = get_base_url()  # Cached for the process
                 url = f"{base_url}/{value}"
-                print(f"Media URL: {url}")
                 return url  # Return the URL string directly to avoid serialization issues
             return value
         raise KeyError(f"Key {key} not found in row")
 
     def __iter__(self):
         """Allow iteration over the row's attributes and values."""
+        self._load_lazy_columns()
         return iter(self._row_data.items())
 
     def items(self):
         """Returns the items of the row as key-value pairs."""
+        self._load_lazy_columns()
         return self._row_data.items()
 
     def keys(self):
         """Returns the keys of the row."""
+        self._load_lazy_columns()
         return self._row_data.keys()
 
     def values(self):
         """Returns the values of the row."""
+        self._load_lazy_columns()
         return self._row_data.values()
 
     def __repr__(self):
@@ -152,28 +786,248 @@ class LiveRow:
 
     def __len__(self):
         """Returns the number of keys in the row."""
-        return len(self._row_data)
+        return len(self._row_data) + len(self._lazy_columns)
 
     def to_dict(self):
         """Explicitly converts the LiveRow to a dictionary."""
+        self._load_lazy_columns()
         return dict(self._row_data)
 
-    def _deserialize(self, row_data):
+class limit:
+    """
+    Search modifier that caps the number of rows a search returns, after skipping
+    `offset` rows, e.g. app_tables.projects.search(order_by('created', ascending=False), limit(20)).
+    The limit is applied by the Uplink server, so only the requested rows are sent.
+    """
+
+    def __init__(self, rows, offset=0):
+        self.rows = rows
+        self.offset = offset
+
+    def __repr__(self):
+        return f"limit({self.rows}, offset={self.offset})"
+
+class SearchIterator:
+    """
+    Lazily iterates over the rows matching a search, loading them from the
+    Uplink server in pages. Supports len() and indexing/slicing without
+    fetching the whole result. Only `columns` (plus the key columns) are
+    fetched if given; otherwise the table's LAZY_COLUMNS are left out.
+    Columns that were not fetched are loaded by LiveRow when first read.
+    Rows are sorted on the server by `order_by` ([column, ascending] pairs), and
+    `limit` / `offset` cap the result there.
+    """
+
+    def __init__(self, table_name, query, page_size=DEFAULT_PAGE_SIZE, columns=None,
+                 order_by=None, limit=None, offset=0):
+        self._table_name = table_name
+        self._query = query
+        self._page_size = page_size
+        self._columns = sorted(columns) if columns else None
+        self._exclude_columns = None if columns else sorted(LAZY_COLUMNS.get(table_name, ())) or None
+        self._order_by = order_by or None
+        self._limit = limit
+        self._offset = offset
+        self._rows = []          # LiveRows loaded so far, in order
+        self._cursor = None      # Keyset cursor for the next page
+        self._exhausted = limit is not None and limit <= 0  # True once the last page has been loaded
+        self._length = None      # Cached result of count_rows
+
+    def _fetch(self, page_size, offset=0):
+        """Fetch rows following the loaded ones, without advancing the iterator."""
+        if not self._rows:
+            offset += self._offset  # The search's own offset applies before the first row
+        cache = _row_caches.get(self._table_name)
+        cache_key = ('page', _normalize_query(self._query), tuple(self._cursor or ()), page_size, offset,
+                     tuple(self._columns or ()), tuple(self._exclude_columns or ()),
+                     _normalize_query(self._order_by))
+        page = cache.get(cache_key) if cache else None
+        if page is None:
+            page = _call('search_page', self._table_name, self._query,
+                         self._cursor, page_size, offset,
+                         columns=self._columns, exclude_columns=self._exclude_columns,
+                         order_by=self._order_by, wire_format=WIRE_FORMAT, compress=COMPRESS_RESULTS)
+            page['rows'] = _unpack_rows(page['rows'])
+            if cache:
+                cache.put(cache_key, page)
+                if not page.get('lazy'):  # Only complete rows are cached by primary key
+                    for row in page['rows']:
+                        cache.put_row(row)
+
+        # Pages carry the media base URL, so media columns resolve without extra calls
+        global _base_url
+        if _base_url is None and page.get('base_url'):
+            _base_url = page['base_url']
+        lazy_columns = page.get('lazy') or ()
+        return [LiveRow(self._table_name, row, lazy_columns) for row in page['rows']], page['next']
+
+    def _load_next_page(self):
+        """Load the next page of rows from the Uplink server."""
+        page_size = self._page_size
+        if self._limit is not None:
+            page_size = min(page_size, self._limit - len(self._rows))
+        rows, self._cursor = self._fetch(page_size)
+        self._rows.extend(rows)
+        self._exhausted = self._cursor is None or (self._limit is not None and len(self._rows) >= self._limit)
+
+    def _load_until(self, count):
+        """Load pages until at least `count` rows are loaded or the results run out."""
+        while len(self._rows) < count and not self._exhausted:
+            self._load_next_page()
+
+    def _load_all(self):
+        """Load every remaining page."""
+        while not self._exhausted:
+            self._load_next_page()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            while index < len(self._rows):
+                yield self._rows[index]
+                index += 1
+            if self._exhausted:
+                return
+            self._load_next_page()
+
+    async def __aiter__(self):
         """
-        Recursively convert serialized strings in row_data to dictionaries, where applicable.
+        Iterates with `async for`, loading each further page on the shared thread
+        pool so the event loop is not blocked. Plain iteration and indexing load
+        pages synchronously.
         """
-        for key, value in row_data.items():
-            if isinstance(value, str):
-                try:
-                    # Attempt to load the string as JSON (to handle dictionaries stored as JSON strings)
-                    row_data[key] = json.loads(value)
-                except (json.JSONDecodeError, TypeError):
-                    # If not JSON, leave it as-is (i.e., treat it as a string)
-                    pass
-            elif isinstance(value, dict):
-                # Recursively deserialize dictionaries
-                row_data[key] = self._deserialize(value)
-        return row_data
+        index = 0
+        while True:
+            while index < len(self._rows):
+                yield self._rows[index]
+                index += 1
+            if self._exhausted:
+                return
+            await _run_async(self._load_next_page)
+
+    def __len__(self):
+        """Returns the number of matching rows, counted on the server if not all rows are loaded."""
+        if self._exhausted:
+            return len(self._rows)
+        if self._length is None:
+            count = _cached_call(self._table_name, ('count', _normalize_query(self._query)),
+                                 'count_rows', self._query)
+            count = max(0, count - self._offset)
+            self._length = count if self._limit is None else min(count, self._limit)
+        return self._length
+
+    def __bool__(self):
+        self._load_until(1)
+        return bool(self._rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if (index.step or 1) < 1 or (index.start or 0) < 0 or index.stop is None or index.stop < 0:
+                # Negative or open-ended slices need the whole result
+                self._load_all()
+                return self._rows[index]
+
+            start = index.start or 0
+            stop = index.stop if self._limit is None else min(index.stop, self._limit)
+            if start >= stop:
+                return []
+            if start > len(self._rows) and not self._exhausted:
+                # Skip straight to the requested rows on the server instead of loading everything before them
+                rows, _ = self._fetch(stop - start, offset=start - len(self._rows))
+                return rows[::index.step or 1]
+
+            self._load_until(index.stop)
+            return self._rows[index]
+
+        if index < 0:
+            self._load_all()
+        else:
+            self._load_until(index + 1)
+        return self._rows[index]
+
+    def __repr__(self):
+        return f"SearchIterator({self._table_name}, {self._query})"
+
+def get_change_seq():
+    """Returns the Uplink server's latest change number, to pass to Table.changes_since later."""
+    return _call('get_change_seq')
+
+# Stands in for the key of a synced row with an empty key field
+_UNKEYED = object()
+
+class SyncedRows:
+    """
+    The rows matching a search, kept up to date from the Uplink server's change feed.
+    refresh() fetches only the rows changed since the last refresh and applies them:
+    changed rows are updated in place (so LiveRows already handed out see the new
+    values), new matches are appended, and deleted or no longer matching rows are dropped.
+    """
+
+    def __init__(self, table_name, query):
+        self._table_name = table_name
+        self._query = query
+        self._rows = OrderedDict()  # Key values -> LiveRow
+        self._seq = None            # Change feed position the rows are up to date with
+        self._load()
+
+    def _load(self):
+        """Loads every matching row."""
+        # Read the feed position first, so changes made while loading are replayed by the next refresh
+        self._seq = _call('get_change_seq')
+        self._rows = OrderedDict()
+        for position, row in enumerate(SearchIterator(self._table_name, self._query)):
+            key = _key_values(self._table_name, row._row_data)
+            if None in key:
+                # Rows without a complete key share no key with the feed, which reloads on their changes
+                key = (_UNKEYED, position)
+            self._rows[key] = row
+
+    def refresh(self):
+        """
+        Applies the changes made since the last refresh and returns the keys of the
+        rows that changed, or None if the server asked for a full reload instead.
+        """
+        changed = []
+        while True:
+            result = _call('changes_since', self._table_name, self._seq, self._query)
+            if result['reset']:
+                logger.debug("Change feed of %s was reset, reloading", self._table_name)
+                self._load()
+                return None
+            for change in result['changes']:
+                key = tuple(change['key'])
+                row_data = change['row']
+                if row_data is None:
+                    self._rows.pop(key, None)
+                elif key in self._rows:
+                    row = self._rows[key]
+                    row._row_data = row_data
+                    row._lazy_columns = set()  # The feed sends whole rows
+                else:
+                    self._rows[key] = LiveRow(self._table_name, row_data)
+                changed.append(key)
+            self._seq = result['seq']
+            if not result['more']:
+                break
+
+        cache = _row_caches.get(self._table_name)
+        if cache:
+            for key in changed:
+                cache.invalidate_row(key)
+        logger.debug("Applied %d changes to %s", len(changed), self._table_name)
+        return changed
+
+    def __iter__(self):
+        return iter(list(self._rows.values()))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        return list(self._rows.values())[index]
+
+    def __repr__(self):
+        return f"SyncedRows({self._table_name}, {self._query}, seq={self._seq})"
 
 class Table:
     """Represents a table in the database."""
@@ -181,113 +1035,326 @@ class Table:
         self._table_name = table_name
         self._original_table = getattr(original_app_tables, table_name, None)
 
+    def enable_cache(self, max_entries=1000, ttl=30):
+        """Enables the client-side row cache for this table (shared by every Table object for it)."""
+        enable_cache(self._table_name, max_entries=max_entries, ttl=ttl)
+
+    def disable_cache(self):
+        """Disables the client-side row cache for this table."""
+        disable_cache(self._table_name)
+
     def add_row(self, **kwargs):
         """Adds a new row to the table."""
         try:
-            print(f"Adding row to {self._table_name} with data: {kwargs}")  # Debug log
-            row_id = anvil.server.call('add_row', self._table_name, **kwargs)
+            logger.debug("Adding row to %s with columns: %s", self._table_name, list(kwargs))
+            row_data = _call('add_row', self._table_name, **kwargs)
+
+            cache = _row_caches.get(self._table_name)
+            if cache:
+                cache.invalidate_queries()
+                cache.put_row(row_data)
 
             # Also add to original_app_tables if replication is enabled
-            if REPLICATE_TO_ANVIL and self._table_name in dir(original_app_tables):
-                table = getattr(original_app_tables, self._table_name)
-                table.add_row(**kwargs)
+            _replicate('add', self._table_name, values=kwargs)
 
-            # Get primary key(s)
-            pk_fields = get_id_field(self._table_name)
+            # Build the row from the stored values returned by the server
+            return LiveRow(self._table_name, row_data)
+
+        except Exception as e:
+            logger.error("Error adding row to %s: %s", self._table_name, e)
+            raise
 
-            # Handle single-field primary key
-            if isinstance(pk_fields, str):
-                return self.get(**{pk_fields: row_id})
+    def add_rows(self, rows):
+        """
+        Adds many rows to the table, sending them to the Uplink server in chunks
+        that are each inserted in a single transaction. Returns the inserted keys.
+        The call is not atomic: if a chunk fails, the chunks before it stay stored
+        (and replicated), and the error log says how many rows were stored.
+        """
+        rows = [dict(row) for row in rows]
+        keys = []
+        try:
+            logger.debug("Adding %d rows to %s", len(rows), self._table_name)
+            for start in range(0, len(rows), ADD_ROWS_CHUNK_SIZE):
+                chunk = rows[start:start + ADD_ROWS_CHUNK_SIZE]
+                try:
+                    keys.extend(_call('add_rows', self._table_name, chunk))
+                finally:
+                    # The chunk may be stored even if the call failed, e.g. after a lost connection
+                    cache = _row_caches.get(self._table_name)
+                    if cache:
+                        cache.invalidate_queries()
 
-            # Handle composite primary key
-            elif isinstance(pk_fields, list):
-                composite_key_values = {field: kwargs[field] for field in pk_fields if field in kwargs}
-                return self.get(**composite_key_values)
+                # Also add to original_app_tables if replication is enabled
+                for row in chunk:
+                    _replicate('add', self._table_name, values=row)
+
+            return keys
 
         except Exception as e:
-            print(f"Error adding row to {self._table_name}: {e}")
+            logger.error("Error adding rows to %s, %d of %d rows were stored: %s",
+                         self._table_name, len(keys), len(rows), e)
             raise
 
-    def get(self, **conditions):
-        """Fetches a single row matching the given conditions."""
+    def get(self, *args, **conditions):
+        """
+        Fetches a single row matching the given conditions.
+        Pass q.fetch_only(...) as a positional argument to fetch only some columns.
+        """
         try:
-            print(f"Fetching row from {self._table_name} with conditions: {conditions}")  # Debug log
-            rows = self.search(**conditions)
+            logger.debug("Fetching row from %s with conditions on: %s", self._table_name, list(conditions))
+            query_args, options = self._split_search_args(args)
+
+            # Serve lookups by primary key from the row cache if enabled
+            cache = _row_caches.get(self._table_name)
+            pk_fields = get_id_field(self._table_name)
+            key_fields = {pk_fields} if isinstance(pk_fields, str) else set(pk_fields)
+            if cache and not query_args and set(conditions) == key_fields and all(
+                    isinstance(value, (str, int, float, bool)) for value in conditions.values()):
+                row_data = cache.get(('row', _key_values(self._table_name, conditions)))
+                if row_data is not None:
+                    return LiveRow(self._table_name, row_data)
+
+            options['page_size'] = 1
+            rows = SearchIterator(self._table_name, self._serialize_query(query_args, conditions), **options)
             return rows[0] if rows else None
         except Exception as e:
-            print(f"Error fetching row from {self._table_name}: {e}")
+            logger.error("Error fetching row from %s: %s", self._table_name, e)
+            raise
+
+    def get_many(self, keys, *args):
+        """
+        Fetches the rows with the given primary keys in one Uplink call. Each key is a
+        value for tables with a single key field, or a tuple (in get_id_field order) or
+        dict of values for composite keys. Returns a list with a LiveRow, or None if
+        there is no such row, for each key in input order.
+        Pass q.fetch_only(...) as a positional argument to fetch only some columns.
+        """
+        try:
+            keys = list(keys)
+            logger.debug("Fetching %d rows from %s by key", len(keys), self._table_name)
+            _, options = self._split_search_args(args)
+            columns = options.get('columns')
+            exclude_columns = None if columns else sorted(LAZY_COLUMNS.get(self._table_name, ())) or None
+
+            pk_fields = get_id_field(self._table_name)
+            key_fields = [pk_fields] if isinstance(pk_fields, str) else list(pk_fields)
+            key_tuples = [tuple(key[field] for field in key_fields) if isinstance(key, dict)
+                          else tuple(key) if isinstance(key, (list, tuple)) else (key,)
+                          for key in keys]
+
+            # Serve what the row cache holds and look up only the rest
+            rows = [None] * len(keys)
+            cache = _row_caches.get(self._table_name)
+            missing = []
+            for index, key in enumerate(key_tuples):
+                row_data = cache.get(('row', key)) if cache else None
+                if row_data is not None:
+                    rows[index] = LiveRow(self._table_name, row_data)
+                else:
+                    missing.append(index)
+
+            if missing:
+                result = _call('get_rows_by_keys', self._table_name, [list(key_tuples[index]) for index in missing],
+                               columns=columns, exclude_columns=exclude_columns,
+                               wire_format=WIRE_FORMAT, compress=COMPRESS_RESULTS)
+                lazy_columns = result.get('lazy') or ()
+                for index, row_data in zip(missing, _unpack_rows(result['rows'])):
+                    if row_data is None:
+                        continue
+                    if cache and not lazy_columns:
+                        cache.put_row(row_data)
+                    rows[index] = LiveRow(self._table_name, row_data, lazy_columns)
+            return rows
+        except Exception as e:
+            logger.error("Error fetching rows by key from %s: %s", self._table_name, e)
             raise
 
     def search(self, *args, **conditions):
-        """Fetches all rows matching the given conditions."""
+        """
+        Returns a lazy SearchIterator over the rows matching the given conditions.
+        Pass q.page_size(n) as a positional argument to change the page size,
+        q.fetch_only('col', ...) to fetch only those columns (plus the key columns),
+        anvil.tables.order_by('col', ascending=False) to sort, and limit(n, offset=0)
+        to cap the result. Sorting and limits are applied by the Uplink server.
+        """
+        try:
+            logger.debug("Searching rows in %s with conditions on: %s and %d args", self._table_name,
+                         list(conditions), len(args))
+            query_args, options = self._split_search_args(args)
+            query = self._serialize_query(query_args, conditions)
+            return SearchIterator(self._table_name, query, **options)
+        except Exception as e:
+            logger.error("Error searching rows in %s: %s", self._table_name, e)
+            raise
+
+    def _split_search_args(self, args):
+        """
+        Separates the search modifiers (q.page_size, q.fetch_only, order_by and limit)
+        from the query conditions in positional arguments. Returns the conditions
+        and the SearchIterator options.
+        """
+        options = {'page_size': DEFAULT_PAGE_SIZE}
+        query_args = []
+        for arg in args:
+            if isinstance(arg, _page_size_type):
+                options['page_size'] = arg.rows
+            elif isinstance(arg, _fetch_only_type):
+                options['columns'] = list(arg.spec)  # Linked-row sub-specs are not supported, only the column names are used
+            elif isinstance(arg, _order_by_type):
+                options.setdefault('order_by', []).append([arg.column_name, arg.ascending])
+            elif isinstance(arg, limit):
+                options['limit'], options['offset'] = arg.rows, arg.offset
+            else:
+                query_args.append(arg)
+        return query_args, options
+
+    def count(self, *args, **conditions):
+        """Returns the number of rows matching the given conditions, counted on the Uplink server."""
+        query = self._serialize_query(args, conditions)
+        return _cached_call(self._table_name, ('count', _normalize_query(query)), 'count_rows', query)
+
+    def exists(self, *args, **conditions):
+        """Returns whether any row matches the given conditions, without fetching it."""
+        query = self._serialize_query(args, conditions)
+        return _cached_call(self._table_name, ('exists', _normalize_query(query)), 'row_exists', query)
+
+    def aggregate(self, aggregates, *args, group_by=None, **conditions):
+        """
+        Computes aggregates over the rows matching the given conditions on the Uplink server.
+        `aggregates` maps result names to (function, column) pairs, with function one of
+        'count', 'sum', 'min', 'max' or 'avg', e.g. {'total': ('sum', 'score'), 'rows': ('count', None)}.
+        Returns a dict of results, or with group_by (a column name or list of names)
+        a list of dicts holding the group column(s) and their results.
+        """
         try:
-            print(f"Searching rows in {self._table_name} with conditions: {conditions} and args: {args}")  # Debug log
-            all_rows = anvil.server.call('fetch_all_rows', self._table_name)
-            filtered_rows = [
-                LiveRow(self._table_name, row)
-                for row in all_rows if self._matches_conditions(row, args, conditions)
-            ]
-            print(f"Found {len(filtered_rows)} matching rows in {self._table_name}")  # Debug log
-            return filtered_rows
+            query = self._serialize_query(args, conditions)
+            aggregates = {name: list(spec) for name, spec in aggregates.items()}
+            logger.debug("Aggregating %s: %s grouped by %s", self._table_name, aggregates, group_by)
+            cache_key = ('aggregate', _normalize_query(query), _normalize_query(aggregates), _normalize_query(group_by))
+            return _cached_call(self._table_name, cache_key, 'aggregate_rows', aggregates, query, group_by)
         except Exception as e:
-            print(f"Error searching rows in {self._table_name}: {e}")
+            logger.error("Error aggregating rows in %s: %s", self._table_name, e)
             raise
 
-    def _matches_conditions(self, row, args, conditions):
-        """Check if a row matches the provided positional and keyword conditions."""
-        # First, evaluate positional conditions
-        for condition in args:
-            if not self._evaluate_condition_on_row(row, condition):
-                return False
-        # Next, evaluate keyword conditions
-        for field, condition in conditions.items():
-            field_value = row.get(field)
-            if not self._evaluate_condition(field_value, condition):
-                return False
-        return True
-
-    def _evaluate_condition_on_row(self, row, condition):
-        """Recursively evaluate a condition that may involve multiple fields in the row."""
-        condition_type_name = condition.__class__.__name__
-        if condition_type_name == 'all_of':
-            return all(self._evaluate_condition_on_row(row, sub_condition) for sub_condition in condition.args)
-        elif condition_type_name == 'any_of':
-            return any(self._evaluate_condition_on_row(row, sub_condition) for sub_condition in condition.args)
-        elif condition_type_name == 'not_':
-            return not self._evaluate_condition_on_row(row, condition.arg)
+    def sync(self, *args, **conditions):
+        """
+        Returns the rows matching the given conditions as SyncedRows, which refresh()
+        keeps up to date by fetching only the rows changed since the last refresh.
+        """
+        query_args, _ = self._split_search_args(args)
+        return SyncedRows(self._table_name, self._serialize_query(query_args, conditions))
+
+    def changes_since(self, seq, *args, **conditions):
+        """
+        Returns the rows changed after change number `seq` (see get_change_seq), optionally
+        limited to rows matching the given conditions. See changes_since on the Uplink server.
+        """
+        query_args, _ = self._split_search_args(args)
+        return _call('changes_since', self._table_name, seq, self._serialize_query(query_args, conditions))
+
+    def sum(self, column, *args, **conditions):
+        """Returns the sum of a column over the rows matching the given conditions."""
+        return self.aggregate({'value': ('sum', column)}, *args, **conditions)['value']
+
+    def min(self, column, *args, **conditions):
+        """Returns the smallest value of a column over the rows matching the given conditions."""
+        return self.aggregate({'value': ('min', column)}, *args, **conditions)['value']
+
+    def max(self, column, *args, **conditions):
+        """Returns the largest value of a column over the rows matching the given conditions."""
+        return self.aggregate({'value': ('max', column)}, *args, **conditions)['value']
+
+    def avg(self, column, *args, **conditions):
+        """Returns the average of a column over the rows matching the given conditions."""
+        return self.aggregate({'value': ('avg', column)}, *args, **conditions)['value']
+
+    # Async variants run the blocking methods on the shared thread pool, so independent
+    # calls can be awaited together with asyncio.gather instead of one after another.
+
+    async def search_async(self, *args, **conditions):
+        """
+        Like search(), with the first page already loaded when the result is returned.
+        Iterate over the result with `async for` to load the further pages without
+        blocking the event loop; `for`, len() and indexing still load them synchronously.
+        """
+        def search():
+            rows = self.search(*args, **conditions)
+            bool(rows)  # Loads the first page
+            return rows
+        return await _run_async(search)
+
+    async def get_async(self, *args, **conditions):
+        """Like get(), without blocking the event loop."""
+        return await _run_async(self.get, *args, **conditions)
+
+    async def add_row_async(self, **kwargs):
+        """Like add_row(), without blocking the event loop."""
+        return await _run_async(self.add_row, **kwargs)
+
+    async def add_rows_async(self, rows):
+        """Like add_rows(), without blocking the event loop."""
+        return await _run_async(self.add_rows, rows)
+
+    async def count_async(self, *args, **conditions):
+        """Like count(), without blocking the event loop."""
+        return await _run_async(self.count, *args, **conditions)
+
+    async def exists_async(self, *args, **conditions):
+        """Like exists(), without blocking the event loop."""
+        return await _run_async(self.exists, *args, **conditions)
+
+    async def aggregate_async(self, aggregates, *args, group_by=None, **conditions):
+        """Like aggregate(), without blocking the event loop."""
+        return await _run_async(self.aggregate, aggregates, *args, group_by=group_by, **conditions)
+
+    def _serialize_query(self, args, conditions):
+        """
+        Convert positional and keyword conditions into a plain query tree
+        that the Uplink server compiles into a SQL WHERE clause.
+        """
+        clauses = [self._serialize_expression(condition) for condition in args]
+        clauses += [self._serialize_field_condition(field, condition) for field, condition in conditions.items()]
+        return {'op': 'and', 'args': clauses}
+
+    def _serialize_expression(self, condition):
+        """Recursively serialize a condition that may involve multiple fields in the row."""
+        operator = _compound_operators.get(type(condition))
+        if operator:
+            clauses = [self._serialize_expression(sub_condition) for sub_condition in condition.args]
+            clauses += [self._serialize_field_condition(field, sub_condition)
+                        for field, sub_condition in condition.kwargs.items()]
+            return {'op': operator, 'args': clauses}
         elif isinstance(condition, dict):
             # Condition is a mapping from field names to conditions
-            return self._evaluate_field_conditions(row, condition)
+            return {'op': 'and', 'args': [self._serialize_field_condition(field, sub_condition)
+                                          for field, sub_condition in condition.items()]}
         else:
             raise ValueError(f"Unsupported condition format: {condition}")
 
-    def _evaluate_field_conditions(self, row, field_conditions):
-        """Evaluate conditions that are mappings from field names to conditions."""
-        for field, condition in field_conditions.items():
-            field_value = row.get(field)
-            if not self._evaluate_condition(field_value, condition):
-                return False
-        return True
-
-    def _evaluate_condition(self, field_value, condition):
-        """Evaluate a condition on a specific field value."""
-        if isinstance(condition, _less_than_type):
-            return field_value < condition.arg
-        elif isinstance(condition, _less_than_or_equal_type):
-            return field_value <= condition.arg
-        elif isinstance(condition, _greater_than_type):
-            return field_value > condition.arg
-        elif isinstance(condition, _greater_than_or_equal_type):
-            return field_value >= condition.arg
-        elif isinstance(condition, _not_type):
-            # Apply not_ to a field condition
-            return not self._evaluate_condition(field_value, condition.arg)
+    def _serialize_field_condition(self, field, condition):
+        """Serialize a condition on a specific field value."""
+        operator = _comparison_operators.get(type(condition))
+        if operator:
+            return {'op': operator, 'field': field, 'value': condition.value}
+
+        operator = _pattern_operators.get(type(condition))
+        if operator:
+            return {'op': operator, 'field': field, 'pattern': condition.pattern}
+        if isinstance(condition, _full_text_match_type):
+            return {'op': 'full_text_match', 'field': field, 'query': condition.query, 'raw': condition.raw}
+
+        operator = _compound_operators.get(type(condition))
+        if operator:
+            # Apply all_of / any_of / not_ to a field condition
+            return {'op': operator, 'args': [self._serialize_field_condition(field, sub_condition)
+                                             for sub_condition in condition.args]}
         elif isinstance(condition, list):
             # Condition is a list of possible values
-            return field_value in condition
+            return {'op': 'in', 'field': field, 'values': condition}
         else:
             # Treat condition as a simple value for equality check
-            return field_value == condition
+            return {'op': '=', 'field': field, 'value': condition}
 
 class AppTablesWrapper:
     """Dynamically wraps database tables to mimic Anvil's app_tables interface."""